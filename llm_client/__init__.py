@@ -0,0 +1,10 @@
+"""Replica-aware Python client for the LLM service
+
+    from llm_client import LLMClient
+
+    with LLMClient(['http://10.0.0.5:8080', 'http://10.0.0.6:8080']) as client:
+        print(client.chat('Write a Python function to sort a list', max_tokens=80))
+"""
+from .client import LLMClient, LLMClientError, RetryBudget
+
+__all__ = ['LLMClient', 'LLMClientError', 'RetryBudget']
@@ -0,0 +1,390 @@
+"""Replica-aware client for the LLM service
+
+Sends each request to the replica with the lowest expected wait, using the
+load hint every replica publishes on /health (queue depth, service time,
+estimated wait) plus this client's own outstanding requests since the last
+poll. Connections are pooled per replica. A request that is still running
+after hedge_after seconds is duplicated on the next-best replica and the
+slower copy is aborted; failed requests are retried on another replica.
+Retries and hedges both draw from a retry budget, so a struggling cluster
+sees at most ~budget_ratio extra load instead of a retry storm.
+"""
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from urllib.parse import urlsplit
+
+# Worth trying again on another replica (499 means the request was cancelled)
+RETRYABLE_STATUS = (500, 502, 503, 504)
+
+class LLMClientError(Exception):
+    """A request failed on every replica it was tried on"""
+
+    def __init__(self, message, status=None, payload=None):
+        super().__init__(message)
+        self.status = status
+        self.payload = payload
+
+class RetryBudget:
+    """Token bucket capping retries and hedges at a fraction of requests
+
+    Every request deposits `ratio` tokens and a retry or hedge spends one.
+    `min_per_second` tokens trickle in regardless, so a client with little
+    traffic can still retry.
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, max_balance=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self._balance = max_balance
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self.max_balance, self._balance + self.ratio)
+
+    def try_spend(self):
+        """Take one token if available"""
+        with self._lock:
+            now = time.monotonic()
+            self._balance = min(self.max_balance,
+                                self._balance + (now - self._updated) * self.min_per_second)
+            self._updated = now
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+class _Replica:
+    """One endpoint: its connection pool, last load hint and local counters"""
+
+    def __init__(self, url, pool_size, timeout):
+        parts = urlsplit(url if '://' in url else f"http://{url}")
+        self.url = f"{parts.scheme}://{parts.netloc}"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.https = parts.scheme == 'https'
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+        self.healthy = True
+        self.hint = {}
+        self.in_flight = 0
+        self.in_flight_at_hint = 0
+        self.latency_ewma = None
+        self.requests = 0
+        self.errors = 0
+
+    def connect(self, timeout=None):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=timeout or self.timeout)
+
+    def acquire(self):
+        """An idle pooled connection, or a new one"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.connect()
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def expected_wait(self):
+        """Server-estimated wait plus the work this client has added since the last poll"""
+        slots = max(1, self.hint.get('slots', 1))
+        service = self.hint.get('service_time_seconds') or self.latency_ewma or 1.0
+        added = max(0, self.in_flight - self.in_flight_at_hint)
+        return self.hint.get('estimated_wait_seconds', 0.0) + added * service / slots
+
+    def info(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'expected_wait_seconds': round(self.expected_wait(), 3),
+            'requests': self.requests,
+            'errors': self.errors
+        }
+
+class _Attempt:
+    """One HTTP exchange with a replica; abort() closes its socket mid-flight"""
+
+    def __init__(self, replica, hedge=False):
+        self.replica = replica
+        self.hedge = hedge
+        self.conn = None
+        self.aborted = False
+
+    def run(self, path, body, headers):
+        """Returns (status, payload) or raises an OSError/HTTPException"""
+        self.conn = self.replica.acquire()
+        if self.aborted:
+            self.conn.close()
+            raise ConnectionAbortedError("attempt aborted")
+        try:
+            reused = self.conn.sock is not None
+            try:
+                self.conn.request('POST', path, body, headers)
+                response = self.conn.getresponse()
+            except (ConnectionError, http.client.HTTPException):
+                # A pooled keep-alive connection may have been closed by the
+                # server; that usually surfaces as RemoteDisconnected from
+                # getresponse(). Retry once on a fresh connection.
+                if not reused or self.aborted:
+                    raise
+                self.conn.close()
+                self.conn = self.replica.connect()
+                self.conn.request('POST', path, body, headers)
+                response = self.conn.getresponse()
+            data = response.read()
+        except BaseException:
+            self.conn.close()
+            raise
+        if response.will_close:
+            self.conn.close()
+        else:
+            self.replica.release(self.conn)
+        try:
+            payload = json.loads(data) if data else {}
+        except ValueError:
+            payload = {'error': data.decode('utf-8', 'replace')}
+        return response.status, payload
+
+    def abort(self):
+        """Drop the connection so the server sees a disconnect and frees the slot"""
+        self.aborted = True
+        conn = self.conn
+        if conn is not None and conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class LLMClient:
+    """Least-loaded routing, hedging and budgeted retries over a set of replicas
+
+    endpoints: base URLs of the replicas, e.g. ['http://10.0.0.5:8080', ...]
+    hedge_after: seconds before a slow request is duplicated on another
+        replica; 'auto' uses this client's observed p95, None disables it
+    """
+
+    def __init__(self, endpoints, timeout=120, pool_size=8, hedge_after='auto',
+                 max_attempts=3, budget_ratio=0.1, budget_min_per_second=1.0,
+                 health_interval=1.0):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.replicas = [_Replica(url, pool_size, timeout) for url in endpoints]
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts
+        self.budget = RetryBudget(budget_ratio, budget_min_per_second)
+        self.health_interval = health_interval
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.replicas) * pool_size + 4,
+                                            thread_name_prefix='llm-client')
+        self.stats = {'requests': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0,
+                      'budget_exhausted': 0, 'failures': 0}
+
+        self._closed = threading.Event()
+        self.poll_health()
+        if health_interval:
+            threading.Thread(target=self._poll_loop, name='llm-client-health', daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._closed.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for replica in self.replicas:
+            replica.close()
+
+    def chat(self, prompt, **params):
+        """POST /chat to the least-loaded replica; returns the response payload"""
+        return self.request('/chat', {'prompt': prompt, **params})
+
+    def request(self, path, body):
+        """POST a JSON body with routing, hedging and retries; returns the payload"""
+        data = json.dumps(body).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        with self._lock:
+            self.stats['requests'] += 1
+        self.budget.deposit()
+
+        start = time.monotonic()
+        results = Queue()
+        running = []
+        tried = set()
+        attempts = 0
+        last_error = None
+
+        def launch(hedge=False):
+            nonlocal attempts
+            replica = self._pick(exclude=tried)
+            tried.add(replica)
+            attempt = _Attempt(replica, hedge)
+            with self._lock:
+                replica.in_flight += 1
+                replica.requests += 1
+            running.append(attempt)
+            attempts += 1
+            self._executor.submit(self._run_attempt, attempt, path, data, headers, results)
+
+        launch()
+        hedge_at = self._hedge_delay()
+        while True:
+            elapsed = time.monotonic() - start
+            wait = self.timeout - elapsed
+            if hedge_at is not None:
+                wait = min(wait, hedge_at - elapsed)
+            try:
+                attempt, status, payload, error = results.get(timeout=max(wait, 0))
+            except Empty:
+                if time.monotonic() - start >= self.timeout:
+                    self._abort(running)
+                    raise LLMClientError(f"No replica answered within {self.timeout}s")
+                # Still running after the hedge delay: race a copy on another replica
+                hedge_at = None
+                if attempts < self.max_attempts and len(tried) < len(self.replicas):
+                    if self.budget.try_spend():
+                        with self._lock:
+                            self.stats['hedges'] += 1
+                        launch(hedge=True)
+                    else:
+                        self._count('budget_exhausted')
+                continue
+
+            running.remove(attempt)
+            if error is None and status == 200:
+                self._abort(running)
+                latency = time.monotonic() - start
+                with self._lock:
+                    self._latencies.append(latency)
+                    if attempt.hedge:
+                        self.stats['hedge_wins'] += 1
+                return payload
+
+            last_error = (f"{attempt.replica.url}: {error}" if error is not None
+                          else f"{attempt.replica.url}: HTTP {status}: {payload.get('error', payload)}")
+            retryable = error is not None or status in RETRYABLE_STATUS
+            if not retryable:
+                self._abort(running)
+                self._count('failures')
+                raise LLMClientError(last_error, status, payload)
+            if attempts < self.max_attempts:
+                if self.budget.try_spend():
+                    with self._lock:
+                        self.stats['retries'] += 1
+                    launch()
+                    continue
+                self._count('budget_exhausted')
+            if not running:
+                self._count('failures')
+                raise LLMClientError(last_error, status, payload if error is None else None)
+
+    def _run_attempt(self, attempt, path, data, headers, results):
+        replica = attempt.replica
+        started = time.monotonic()
+        status = payload = error = None
+        try:
+            status, payload = attempt.run(path, data, headers)
+        except (OSError, http.client.HTTPException) as e:
+            error = e
+        with self._lock:
+            replica.in_flight -= 1
+            if error is not None or status >= 500:
+                if not attempt.aborted:
+                    replica.errors += 1
+                    # Connection-level failures take a replica out of rotation until it answers /health
+                    replica.healthy = replica.healthy and error is None
+            else:
+                latency = time.monotonic() - started
+                replica.latency_ewma = (latency if replica.latency_ewma is None
+                                        else 0.8 * replica.latency_ewma + 0.2 * latency)
+        if not attempt.aborted:
+            results.put((attempt, status, payload, error))
+
+    def _abort(self, attempts):
+        for attempt in attempts:
+            attempt.abort()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _hedge_delay(self):
+        """Seconds after which to hedge, or None"""
+        if self.hedge_after != 'auto':
+            return self.hedge_after
+        with self._lock:
+            if len(self._latencies) < 20:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95)]
+
+    def _pick(self, exclude=()):
+        """Replica with the lowest expected wait, preferring healthy, untried ones"""
+        with self._lock:
+            for candidates in ([r for r in self.replicas if r.healthy and r not in exclude],
+                               [r for r in self.replicas if r not in exclude],
+                               self.replicas):
+                if candidates:
+                    return min(candidates, key=lambda r: (r.expected_wait(), r.in_flight, random.random()))
+
+    # Load hints
+
+    def poll_health(self):
+        """Refresh every replica's health and load hint (run periodically in the background)"""
+        for replica in self.replicas:
+            conn = replica.connect(timeout=min(2.0, self.timeout))
+            try:
+                conn.request('GET', '/health')
+                response = conn.getresponse()
+                data = json.loads(response.read() or b'{}')
+                healthy = response.status == 200
+            except (OSError, http.client.HTTPException, ValueError):
+                data, healthy = {}, False
+            finally:
+                conn.close()
+            with self._lock:
+                replica.healthy = healthy
+                replica.hint = data.get('load') or {}
+                replica.in_flight_at_hint = replica.in_flight
+
+    def _poll_loop(self):
+        while not self._closed.wait(self.health_interval):
+            self.poll_health()
+
+    def info(self):
+        """Client counters plus per-replica routing state"""
+        hedge_after = self._hedge_delay()
+        with self._lock:
+            return {
+                **self.stats,
+                'hedge_after_seconds': hedge_after,
+                'replicas': [replica.info() for replica in self.replicas]
+            }
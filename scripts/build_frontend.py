@@ -0,0 +1,112 @@
+"""Build the frontend into hashed, minified, precompressed static assets
+
+Splits the inline <style> and <script> of frontend/index.html into
+app.<hash>.css and app.<hash>.js, minifies all three, and writes them with
+.gz (and .zst if zstandard is installed) siblings to frontend/dist/. The
+content hash in the file name lets them be cached forever; only index.html
+is revalidated.
+
+Usage:
+    python scripts/build_frontend.py [--api-url http://YOUR-EXTERNAL-IP]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SOURCE = os.path.join(ROOT, 'frontend', 'index.html')
+DIST = os.path.join(ROOT, 'frontend', 'dist')
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+def minify_js(js):
+    """Conservative minification: drop comments-only text, indentation and blank lines
+
+    Newlines are kept so automatic semicolon insertion behaves as before.
+    Only `//` comments preceded by whitespace are removed, which leaves
+    URLs such as 'http://...' inside strings untouched.
+    """
+    lines = []
+    for line in js.splitlines():
+        line = re.sub(r'(^|\s)//.*$', '', line).strip()
+        if line:
+            lines.append(line)
+    return '\n'.join(lines)
+
+def minify_html(html):
+    return '\n'.join(line.strip() for line in html.splitlines() if line.strip())
+
+def content_name(stem, ext, body):
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:10]}.{ext}"
+
+def write_asset(name, body):
+    """Write an asset plus its precompressed variants; returns sizes"""
+    with open(os.path.join(DIST, name), 'wb') as f:
+        f.write(body)
+    sizes = {'raw': len(body)}
+    gz = gzip.compress(body, compresslevel=9, mtime=0)
+    with open(os.path.join(DIST, name + '.gz'), 'wb') as f:
+        f.write(gz)
+    sizes['gzip'] = len(gz)
+    if HAS_ZSTD:
+        zst = zstandard.ZstdCompressor(level=19).compress(body)
+        with open(os.path.join(DIST, name + '.zst'), 'wb') as f:
+            f.write(zst)
+        sizes['zstd'] = len(zst)
+    return sizes
+
+def build(api_url=None):
+    with open(SOURCE, encoding='utf-8') as f:
+        html = f.read()
+
+    style = re.search(r'<style>(.*?)</style>', html, flags=re.S)
+    script = re.search(r'<script>(.*?)</script>', html, flags=re.S)
+    css = minify_css(style.group(1)).encode('utf-8')
+    js_source = script.group(1)
+    if api_url:
+        js_source = re.sub(r"const API_URL = '[^']*';", f"const API_URL = '{api_url}';", js_source)
+    js = minify_js(js_source).encode('utf-8')
+
+    css_name = content_name('app', 'css', css)
+    js_name = content_name('app', 'js', js)
+    html = html.replace(style.group(0), f'<link rel="stylesheet" href="/{css_name}">')
+    html = html.replace(script.group(0), f'<script src="/{js_name}"></script>')
+    page = minify_html(html).encode('utf-8')
+
+    shutil.rmtree(DIST, ignore_errors=True)
+    os.makedirs(DIST)
+    manifest = {}
+    for name, body in ((css_name, css), (js_name, js), ('index.html', page)):
+        manifest[name] = write_asset(name, body)
+
+    with open(os.path.join(DIST, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description='Build hashed, precompressed frontend assets')
+    parser.add_argument('--api-url', help="Override the API_URL baked into the page ('' = same origin)")
+    args = parser.parse_args()
+
+    manifest = build(args.api_url)
+    print(f"✅ Built frontend into {os.path.relpath(DIST)}")
+    for name, sizes in manifest.items():
+        detail = ', '.join(f"{k} {v}B" for k, v in sizes.items())
+        print(f"   {name:<28} {detail}")
+
+if __name__ == '__main__':
+    main()
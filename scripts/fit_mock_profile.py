@@ -0,0 +1,106 @@
+"""Fit the mock backend cost model from real inference runs
+
+Sends a sweep of prompts with different lengths and max_tokens to a running
+llama-cpp service (or reads previously collected samples) and fits
+
+    latency = overhead + prompt_tokens * prompt_eval + completion_tokens * decode
+
+The result is printed as MOCK_* environment variables for src/inference_mock.py.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import requests
+
+FILLER = ("Consider a service that stores records in a table and exposes them "
+          "through a small HTTP API with pagination and basic filtering").split()
+
+def build_prompt(n_words):
+    """Build a code prompt padded with filler context to n_words words"""
+    words = "Write a Python function that".split()
+    while len(words) < n_words:
+        words.append(FILLER[len(words) % len(FILLER)])
+    return " ".join(words)
+
+def collect_samples(url, prompt_sizes, max_tokens_list, repeats):
+    """Collect (prompt_tokens, completion_tokens, latency) samples from a live service"""
+    samples = []
+    for n_words in prompt_sizes:
+        for max_tokens in max_tokens_list:
+            for _ in range(repeats):
+                prompt = build_prompt(n_words)
+                start = time.time()
+                response = requests.post(
+                    f"{url}/chat",
+                    json={'prompt': prompt, 'max_tokens': max_tokens, 'temperature': 0.0},
+                    timeout=300
+                )
+                latency = time.time() - start
+                if response.status_code != 200:
+                    print(f"❌ Request failed: HTTP {response.status_code}")
+                    continue
+                data = response.json()
+                # app.py wraps the prompt in [INST] ... [/INST]
+                samples.append({
+                    'prompt_tokens': len(prompt.split()) + 2,
+                    'completion_tokens': data.get('tokens_generated', 0),
+                    'latency': data.get('latency_seconds', latency)
+                })
+                print(f"  prompt={n_words:4d} max_tokens={max_tokens:4d} "
+                      f"-> {samples[-1]['completion_tokens']} tokens in {samples[-1]['latency']:.2f}s")
+    return samples
+
+def fit_profile(samples):
+    """Least-squares fit of the mock cost model; returns overhead/prompt/decode seconds"""
+    X = np.array([[1.0, s['prompt_tokens'], s['completion_tokens']] for s in samples])
+    y = np.array([s['latency'] for s in samples])
+    coef, _, _, _ = np.linalg.lstsq(X, y, rcond=None)
+    coef = np.clip(coef, 0.0, None)
+
+    residuals = y - X @ coef
+    return {
+        'overhead': float(coef[0]),
+        'prompt_eval': float(coef[1]),
+        'decode': float(coef[2]),
+        'jitter': float(np.std(residuals / np.maximum(y, 1e-6))),
+        'output_tokens': int(np.median([s['completion_tokens'] for s in samples]))
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit mock backend cost model')
+    parser.add_argument('--url', help='Base URL of a llama-cpp backed service')
+    parser.add_argument('--samples', help='JSON file with previously collected samples')
+    parser.add_argument('--save', help='Write collected samples to this JSON file')
+    parser.add_argument('--repeats', type=int, default=2,
+                       help='Requests per (prompt size, max_tokens) pair (default: 2)')
+    args = parser.parse_args()
+
+    if args.samples:
+        with open(args.samples) as f:
+            samples = json.load(f)
+    elif args.url:
+        print(f"🎯 Collecting samples from {args.url}...")
+        samples = collect_samples(args.url, [8, 64, 256, 512], [16, 64, 128], args.repeats)
+    else:
+        parser.error('one of --url or --samples is required')
+
+    if len(samples) < 3:
+        print("❌ Need at least 3 samples to fit the cost model")
+        return
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(samples, f, indent=2)
+
+    profile = fit_profile(samples)
+    print(f"\n📊 Fitted cost model from {len(samples)} samples:")
+    print(f"export MOCK_REQUEST_OVERHEAD={profile['overhead']:.4f}")
+    print(f"export MOCK_PROMPT_EVAL_PER_TOKEN={profile['prompt_eval']:.5f}")
+    print(f"export MOCK_DECODE_PER_TOKEN={profile['decode']:.5f}")
+    print(f"export MOCK_JITTER={profile['jitter']:.3f}")
+    print(f"export MOCK_OUTPUT_TOKENS={profile['output_tokens']}")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,23 @@
 """Main Flask API application"""
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, abort, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import time
 import os
+import random
 import sys
+import uuid
+import zlib
+
+import config
+import wire
+from structured import parse_response_format, grammar_cache_info
+from backends import load_backend
+from length_predictor import LengthPredictor, ServiceTime
+from metrics import MetricsAggregator
+from scheduler import AdmissionScheduler
+from static_assets import StaticAssets
+from generation import (GenerationAborted, GenerationLimits, disconnect_monitor,
+                        parse_max_tokens, parse_seconds, parse_stop, parse_temperature)
 
 app = Flask(__name__, static_folder='../frontend')
 CORS(app)  # Enable CORS for frontend access
@@ -11,110 +25,415 @@ CORS(app)  # Enable CORS for frontend access
 # Configuration
 MODEL_PATH = os.environ.get('MODEL_PATH', 'models/llama-3.2-3b-q4.gguf')
 USE_OLLAMA = os.environ.get('USE_OLLAMA', 'false').lower() == 'true'
+USE_MOCK = os.environ.get('USE_MOCK', 'false').lower() == 'true'
 
 # Auto-detect: Use Ollama on macOS for local development, llama-cpp-python in Docker
-if sys.platform == 'darwin' and not os.path.exists('/.dockerenv'):
+if sys.platform == 'darwin' and not os.path.exists('/.dockerenv') and not USE_MOCK and not config.BACKEND:
     # Running on macOS locally - use Ollama
     USE_OLLAMA = True
     print("🍎 Detected macOS - using Ollama for local development")
 
 # Load appropriate inference engine
 print("Initializing LLM service...")
+BACKEND = config.BACKEND or ('mock' if USE_MOCK else 'ollama' if USE_OLLAMA else 'llama-cpp')
 try:
-    if USE_OLLAMA:
-        from inference_ollama import LLMInference
-        llm = LLMInference()
-        MODEL_NAME = "ollama:codellama:7b-instruct"
-        print("✅ Using Ollama inference engine")
-    else:
-        from inference import LLMInference
-        llm = LLMInference(MODEL_PATH)
-        MODEL_NAME = os.path.basename(MODEL_PATH)
-        print("✅ Using llama-cpp-python inference engine")
-except ImportError as e:
-    print(f"❌ Error loading inference engine: {e}")
-    print("📝 Falling back to mock inference for testing")
-    from inference_mock import LLMInference
-    llm = LLMInference(MODEL_PATH)
-    MODEL_NAME = f"mock:{os.path.basename(MODEL_PATH)}"
+    llm = load_backend(BACKEND, MODEL_PATH, worker=config.BACKEND_WORKER)
 except Exception as e:
     print(f"❌ Error initializing LLM: {e}")
     raise
+MODEL_NAME = llm.name
+
+# Optional semantic cache for near-duplicate prompts
+semantic_cache = None
+if config.SEMANTIC_CACHE_ENABLED:
+    from semantic_cache import SemanticCache, make_embedder, params_signature
+    semantic_cache = SemanticCache(
+        make_embedder(config.SEMANTIC_CACHE_EMBEDDER, backend=llm),
+        threshold=config.SEMANTIC_CACHE_THRESHOLD,
+        max_bytes=config.SEMANTIC_CACHE_MAX_MB * 1024 * 1024
+    )
+    print(f"✅ Semantic cache enabled (threshold {config.SEMANTIC_CACHE_THRESHOLD}, "
+          f"{config.SEMANTIC_CACHE_MAX_MB}MB, embedder {semantic_cache.embedder.name})")
+
+# Optional audit log of prompts and completions for quality review
+audit_log = None
+if config.AUDIT_LOG_ENABLED:
+    from audit_log import AuditLog
+    audit_log = AuditLog(config.AUDIT_LOG_DIR, capacity=config.AUDIT_LOG_BUFFER,
+                         batch_size=config.AUDIT_LOG_BATCH,
+                         flush_seconds=config.AUDIT_LOG_FLUSH_SECONDS,
+                         max_file_mb=config.AUDIT_LOG_MAX_MB, compress=config.AUDIT_LOG_COMPRESS)
+    print(f"✅ Audit log enabled ({config.AUDIT_LOG_DIR})")
+
+# Optional trace of traffic shape (timing, prompt size, parameters, output size) for replay
+trace_log = None
+if config.TRACE_CAPTURE:
+    from audit_log import AuditLog
+    trace_log = AuditLog(config.TRACE_DIR, prefix='trace', capacity=config.AUDIT_LOG_BUFFER,
+                         batch_size=config.AUDIT_LOG_BATCH,
+                         flush_seconds=config.AUDIT_LOG_FLUSH_SECONDS,
+                         max_file_mb=config.AUDIT_LOG_MAX_MB, compress=config.AUDIT_LOG_COMPRESS)
+    print(f"✅ Trace capture enabled ({config.TRACE_DIR}, sample rate {config.TRACE_SAMPLE_RATE})")
+
+# Admission queue in front of the backend, ordered by predicted output length.
+# Backends with their own dispatcher (Ollama) queue and coalesce calls
+# themselves; a second gate in front would keep duplicates from merging.
+scheduler = length_predictor = service_time = None
+if llm.capabilities().get('dispatcher'):
+    print("✅ Admission queue: handled by the backend's dispatcher")
+else:
+    scheduler = AdmissionScheduler(config.ADMISSION_SLOTS or llm.capabilities()['slots'],
+                                   aging=config.SCHEDULER_AGING)
+    if config.LENGTH_PREDICTOR:
+        length_predictor = LengthPredictor(dim=config.LENGTH_PREDICTOR_DIM)
+        service_time = ServiceTime()
+    print(f"✅ Admission queue: {scheduler.slots} slot(s), "
+          f"{'shortest predicted job first' if length_predictor else 'FIFO'}")
 
 print("Service ready!")
 
-# Metrics
-stats = {
-    'total_requests': 0,
-    'total_tokens': 0,
-    'total_latency': 0.0
-}
+# Metrics: sharded per thread, merged on read by /metrics
+request_metrics = MetricsAggregator()
+
+# Built frontend (scripts/build_frontend.py) held in memory; raw index.html if not built
+assets = StaticAssets(os.path.join(app.static_folder, 'dist'), fallback_dir=app.static_folder)
 
 @app.route('/')
 def index():
     """Serve frontend HTML"""
-    return send_from_directory(app.static_folder, 'index.html')
+    return static_asset('index.html')
+
+def static_asset(name):
+    """Serve a frontend asset with ETag/304 and precompressed variants"""
+    if not config.SERVE_FRONTEND:
+        abort(404)
+    result = assets.lookup(name, request.headers.get('Accept-Encoding'),
+                           request.headers.get('If-None-Match'))
+    if result is None:
+        abort(404)
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
+
+# One rule per loaded asset rather than a /<name> catch-all, which would also
+# answer GET on POST-only API paths with 404 instead of 405
+for asset_name in assets.files:
+    app.add_url_rule(f'/{asset_name}', 'static_asset', static_asset, defaults={'name': asset_name})
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint for Kubernetes"""
+    """Health check endpoint for Kubernetes
+
+    503 only when the backend is unavailable; a worker that is restarting
+    still reports 200 so liveness probes do not kill the pod meanwhile.
+    """
+    backend = llm.health()
     return jsonify({
-        'status': 'healthy',
-        'model': MODEL_NAME
-    }), 200
+        'status': backend['status'],
+        'model': MODEL_NAME,
+        'backend': backend,
+        'capabilities': llm.capabilities(),
+        'load': load_hint(),
+        'tuning': llm.tuning
+    }), 503 if backend['status'] == 'unavailable' else 200
+
+def load_hint():
+    """Queue depth and expected wait, used by llm_client to pick the least-loaded replica"""
+    in_flight = request_metrics.in_flight
+    slots = scheduler.slots if scheduler is not None else llm.capabilities()['slots']
+    # Time requests spend in the backend; end-to-end latency would count queueing twice
+    typical = (request_metrics.window(60)['avg_service_seconds']
+               or request_metrics.totals()['average_service_seconds'])
+    # Predicted remaining work of running and queued requests, when available
+    wait = scheduler.estimated_wait() if length_predictor is not None else None
+    if wait is None:
+        wait = max(0, in_flight - slots + 1) * (typical or 0) / slots
+    return {
+        'in_flight': in_flight,
+        'slots': slots,
+        'queue_depth': scheduler.queue_depth if scheduler is not None else max(0, in_flight - slots),
+        'service_time_seconds': typical,
+        'estimated_wait_seconds': round(wait, 3)
+    }
 
 @app.route('/chat', methods=['POST'])
 def chat():
     """Main inference endpoint"""
+    try:
+        data = wire.decode_request(request)
+    except ValueError as e:
+        return respond({'error': str(e)}, 415)
+    client_socket = disconnect_monitor.socket_for(request.environ)
+    return respond(*process_chat(data, client_socket))
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Run several /chat requests and stream one result per item as it finishes
+
+    The body is {"requests": [<chat request>, ...]}. Results are NDJSON lines
+    (or concatenated msgpack objects) tagged with their index, encoded and
+    compressed incrementally so the full response is never held in memory.
+    """
+    try:
+        data = wire.decode_request(request)
+    except ValueError as e:
+        return respond({'error': str(e)}, 415)
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return respond({'error': 'Missing requests list'}, 400)
+    if len(items) > config.BATCH_MAX_ITEMS:
+        return respond({'error': f"At most {config.BATCH_MAX_ITEMS} requests per batch"}, 400)
+
+    use_msgpack = wire.wants_msgpack(request.headers.get('Accept'))
+    coding = wire.choose_encoding(request.headers.get('Accept-Encoding'))
+    client_socket = disconnect_monitor.socket_for(request.environ)
+    bytes_in = request.content_length or 0
+
+    def generate():
+        compressor = wire.StreamCompressor(coding)
+        body_bytes = out_bytes = 0
+        cpu = 0.0
+        for index, item in enumerate(items):
+            payload, status = process_chat(item if isinstance(item, dict) else None, client_socket)
+            cpu_start = time.thread_time()
+            raw = wire.encode_stream_item({'index': index, 'status': status, **payload}, use_msgpack)
+            chunk = compressor.write(raw)
+            cpu += time.thread_time() - cpu_start
+            body_bytes += len(raw)
+            out_bytes += len(chunk)
+            yield chunk
+        tail = compressor.close()
+        out_bytes += len(tail)
+        request_metrics.record_wire(bytes_in, body_bytes, out_bytes, cpu)
+        yield tail
+
+    response = Response(stream_with_context(generate()),
+                        mimetype=wire.MSGPACK_MIMETYPES[0] if use_msgpack else wire.NDJSON_MIMETYPE)
+    if coding:
+        response.headers['Content-Encoding'] = coding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+def respond(payload, status=200):
+    """Encode payload as JSON or msgpack, whichever the client accepts"""
+    cpu_start = time.thread_time()
+    body, mimetype = wire.encode(payload, wire.wants_msgpack(request.headers.get('Accept')))
+    g.serialize_cpu = time.thread_time() - cpu_start
+    g.body_bytes = len(body)
+    response = Response(body, status=status, mimetype=mimetype)
+    # The body depends on Accept, so caches must not serve msgpack to JSON clients
+    response.headers.add('Vary', 'Accept')
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compress large buffered bodies and record wire metrics for respond() output"""
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+
+    cpu = 0.0
+    coding = wire.choose_encoding(request.headers.get('Accept-Encoding'))
+    if coding and response.status_code == 200 and (response.content_length or 0) >= config.COMPRESS_MIN_BYTES:
+        cpu_start = time.thread_time()
+        response.set_data(wire.compress(response.get_data(), coding))
+        cpu = time.thread_time() - cpu_start
+        response.headers['Content-Encoding'] = coding
+        response.headers.add('Vary', 'Accept-Encoding')
+
+    if 'body_bytes' in g:
+        request_metrics.record_wire(request.content_length or 0, g.body_bytes,
+                                    response.content_length, g.serialize_cpu + cpu)
+    return response
+
+def process_chat(data, client_socket=None):
+    """Parse, generate and build the result for one chat request
+
+    Returns (payload, status). Shared by /chat and /chat/batch.
+    """
+    start_time = time.time()
+    request_metrics.request_started()
+    try:
+        payload, status = _process_chat(data, client_socket)
+    finally:
+        request_metrics.request_finished()
+    request_id = uuid.uuid4().hex
+    if audit_log is not None:
+        audit_log.record(audit_entry(request_id, start_time, data, payload, status))
+    if trace_log is not None and random.random() < config.TRACE_SAMPLE_RATE:
+        trace_log.record(trace_entry(request_id, start_time, data, payload, status))
+    return payload, status
+
+def audit_entry(request_id, start_time, data, payload, status):
+    """One audit log line: the request as received plus the outcome"""
+    request = dict(data) if isinstance(data, dict) else {'invalid_body': data}
+    return {
+        'request_id': request_id,
+        'timestamp': start_time,
+        'prompt': request.pop('prompt', None),
+        'params': request,
+        'status': status,
+        'response': payload.get('response'),
+        'error': payload.get('error'),
+        'tokens_generated': payload.get('tokens_generated'),
+        'finish_reason': payload.get('finish_reason'),
+        'cached': payload.get('cached', False),
+        'latency_seconds': payload.get('latency_seconds'),
+        'model': MODEL_NAME
+    }
+
+def trace_entry(request_id, start_time, data, payload, status):
+    """One trace line: the shape of the request and outcome, without any text
+
+    prompt_hash lets a replay repeat the same synthetic prompt wherever the
+    original traffic repeated a prompt, so cache hit rates carry over.
+    """
+    request = dict(data) if isinstance(data, dict) else {}
+    prompt = request.pop('prompt', None)
+    prompt = prompt if isinstance(prompt, str) else ''
+    return {
+        'request_id': request_id,
+        'timestamp': start_time,
+        'prompt_chars': len(prompt),
+        'prompt_words': len(prompt.split()),
+        'prompt_hash': f"{zlib.crc32(prompt.encode('utf-8')):08x}",
+        'params': request,
+        'status': status,
+        'tokens_generated': payload.get('tokens_generated'),
+        'finish_reason': payload.get('finish_reason'),
+        'cached': payload.get('cached', False),
+        'latency_seconds': payload.get('latency_seconds'),
+        'model': MODEL_NAME
+    }
+
+def _process_chat(data, client_socket):
+    """Body of process_chat, run while the request is counted as in flight"""
     start_time = time.time()
 
     try:
         # Parse request
-        data = request.json
+        if data is not None and not isinstance(data, dict):
+            return {'error': 'Request body must be a JSON object'}, 400
         if not data or 'prompt' not in data:
-            return jsonify({'error': 'Missing prompt field'}), 400
+            return {'error': 'Missing prompt field'}, 400
 
         prompt = data['prompt']
-        max_tokens = data.get('max_tokens', 150)
-        temperature = data.get('temperature', 0.7)
+        if not isinstance(prompt, str):
+            return {'error': 'prompt must be a string'}, 400
+        try:
+            max_tokens = parse_max_tokens(data.get('max_tokens'), 150)
+            temperature = parse_temperature(data.get('temperature'), 0.7)
+            response_format = parse_response_format(data.get('response_format'))
+            stop = parse_stop(data.get('stop'))
+            limits = GenerationLimits(
+                start_time=start_time,
+                timeout_seconds=parse_seconds(data.get('timeout_seconds'), 'timeout_seconds'),
+                max_ttft_seconds=parse_seconds(data.get('max_ttft_seconds'), 'max_ttft_seconds')
+            )
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        # Grammars and JSON schemas need a backend that can constrain decoding
+        kind = response_format['type'] if response_format is not None else None
+        if kind in ('grammar', 'json_schema') and not llm.capabilities().get(kind):
+            return {'error': f"response_format type '{kind}' is not supported by the {BACKEND} backend"}, 400
+
+        # Serve near-duplicate prompts from the semantic cache
+        signature = None
+        if semantic_cache is not None:
+            signature = params_signature(max_tokens=max_tokens, temperature=temperature,
+                                         stop=stop, response_format=response_format)
+            cached, similarity = semantic_cache.lookup(prompt, signature)
+            if cached is not None:
+                latency = time.time() - start_time
+                request_metrics.record(latency, cached['tokens_generated'])
+                return {
+                    **cached,
+                    'model': MODEL_NAME,
+                    'latency_seconds': round(latency, 3),
+                    'cached': True,
+                    'similarity': round(similarity, 4)
+                }, 200
+
+        cache_prompt = prompt
         prompt = f"[INST] {prompt} [/INST]"
-       
 
+        # Abort generation as soon as the client hangs up, freeing the slot
+        if client_socket is not None:
+            disconnect_monitor.watch(client_socket, limits.cancel_event)
+
+        # Predicted cost decides the request's place in the admission queue
+        features = cost = None
+        if length_predictor is not None:
+            features = length_predictor.features(cache_prompt, max_tokens, response_format)
+            cost = service_time.seconds(length_predictor.predict(features, max_tokens))
 
         # Generate response
-        response = llm.generate(prompt, max_tokens, temperature)
+        try:
+            job = scheduler.acquire(cost, limits) if scheduler is not None else None
+            generate_start = time.time()
+            try:
+                response = llm.generate(prompt, max_tokens, temperature,
+                                        response_format=response_format, stop=stop, limits=limits)
+            finally:
+                if job is not None:
+                    scheduler.release(job)
+            # Backends with their own dispatcher queue inside generate()
+            service_seconds = time.time() - generate_start - limits.queue_wait
+        except GenerationAborted as e:
+            request_metrics.record(time.time() - start_time, error=True)
+            return {'error': str(e)}, e.status_code
+        finally:
+            if client_socket is not None:
+                disconnect_monitor.unwatch(client_socket)
 
         # Calculate metrics
         latency = time.time() - start_time
         tokens_generated = response['usage']['completion_tokens']
 
         # Update stats
-        stats['total_requests'] += 1
-        stats['total_tokens'] += tokens_generated
-        stats['total_latency'] += latency
+        request_metrics.record(latency, tokens_generated, service_seconds=service_seconds)
 
-        return jsonify({
+        result = {
             'response': response['choices'][0]['text'].strip(),
+            'tokens_generated': tokens_generated,
+            'finish_reason': response['choices'][0].get('finish_reason', 'stop')
+        }
+        if length_predictor is not None:
+            length_predictor.observe(features, tokens_generated,
+                                     truncated=result['finish_reason'] in ('length', 'time_limit'))
+            service_time.observe(service_seconds, tokens_generated)
+        # Partial answers cut off by a time budget are not worth reusing
+        if semantic_cache is not None and result['finish_reason'] != 'time_limit':
+            semantic_cache.insert(cache_prompt, signature, result)
+
+        return {
+            **result,
             'model': MODEL_NAME,
-            'latency_seconds': round(latency, 3),
-            'tokens_generated': tokens_generated
-        }), 200
+            'latency_seconds': round(latency, 3)
+        }, 200
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        request_metrics.record(time.time() - start_time, error=True)
+        return {'error': str(e)}, 500
 
 @app.route('/metrics', methods=['GET'])
 def metrics():
-    """Prometheus-compatible metrics endpoint"""
-    avg_latency = (stats['total_latency'] / stats['total_requests']
-                   if stats['total_requests'] > 0 else 0)
+    """Prometheus-compatible metrics endpoint
+
+    JSON by default; ?format=prometheus returns the text exposition format.
+    """
+    if request.args.get('format') == 'prometheus':
+        return Response(request_metrics.prometheus(MODEL_NAME), mimetype='text/plain')
 
     return jsonify({
-        'total_requests': stats['total_requests'],
-        'total_tokens': stats['total_tokens'],
-        'average_latency_seconds': round(avg_latency, 3),
+        **request_metrics.snapshot(),
+        'grammar_cache': grammar_cache_info(),
+        'semantic_cache': semantic_cache.info() if semantic_cache is not None else None,
+        'upstream': llm.upstream_info(),
+        'scheduler': scheduler.info() if scheduler is not None else None,
+        'length_predictor': length_predictor.info() if length_predictor is not None else None,
+        'audit_log': audit_log.info() if audit_log is not None else None,
+        'trace': trace_log.info() if trace_log is not None else None,
         'model': MODEL_NAME
     }), 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=False)
+    app.run(host=config.API_HOST, port=config.API_PORT, debug=False)
@@ -0,0 +1,129 @@
+"""Append-only JSONL audit log that never blocks the request path
+
+record() puts an entry in a bounded in-memory buffer and returns at once;
+when the buffer is full the entry is dropped and counted instead of
+waiting. A background thread drains the buffer in batches, writes one JSON
+object per line (gzip-compressed by default, one member per batch so every
+fsynced batch is readable), fsyncs at most once per batch and rotates to a
+new file past max_file_mb. Lines carry a request_id, like requests.jsonl.
+"""
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from collections import deque
+
+class AuditLog:
+    """Bounded buffer plus batching background writer for JSONL records"""
+
+    def __init__(self, directory, prefix='audit', capacity=10000, batch_size=256,
+                 flush_seconds=1.0, max_file_mb=64, compress=True):
+        self.directory = directory
+        self.prefix = prefix
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_file_bytes = max_file_mb * 1024 * 1024
+        self.compress = compress
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._file = None
+        self._file_bytes = 0
+        self._sequence = 0
+        self.path = None
+
+        self.stats = {
+            'recorded': 0,
+            'dropped': 0,
+            'written': 0,
+            'batches': 0,
+            'bytes_written': 0,
+            'files': 0,
+            'write_errors': 0
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name=f'{prefix}-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, entry):
+        """Queue entry for writing; returns False if it was dropped (buffer full)"""
+        with self._cond:
+            if self._closed or len(self._buffer) >= self.capacity:
+                self.stats['dropped'] += 1
+                return False
+            self._buffer.append(entry)
+            self.stats['recorded'] += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def close(self, timeout=5.0):
+        """Write what is buffered and stop the writer"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.batch_size and not self._closed:
+                    self._cond.wait(self.flush_seconds)
+                batch = [self._buffer.popleft() for _ in range(len(self._buffer))]
+                closing = self._closed
+            if batch:
+                self._write(batch)
+            if closing:
+                if self._file is not None:
+                    self._file.close()
+                return
+
+    def _write(self, batch):
+        data = ''.join(json.dumps(entry, separators=(',', ':'), default=str) + '\n'
+                       for entry in batch).encode('utf-8')
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        try:
+            if self._file is None or self._file_bytes >= self.max_file_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            with self._cond:
+                self.stats['write_errors'] += 1
+                self.stats['dropped'] += len(batch)
+            print(f"❌ {self.prefix} log write failed, dropped {len(batch)} record(s): {e}")
+            return
+        self._file_bytes += len(data)
+        with self._cond:
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['bytes_written'] += len(data)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self._sequence += 1
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        suffix = '.jsonl.gz' if self.compress else '.jsonl'
+        # pid keeps files apart when several gunicorn workers share the directory
+        self.path = os.path.join(self.directory,
+                                 f"{self.prefix}-{stamp}-{os.getpid()}-{self._sequence}{suffix}")
+        self._file = open(self.path, 'ab')
+        self._file_bytes = 0
+        self.stats['files'] += 1
+
+    def info(self):
+        """Counters for /metrics"""
+        with self._cond:
+            return {**self.stats, 'buffered': len(self._buffer), 'capacity': self.capacity,
+                    'path': self.path}
@@ -0,0 +1,215 @@
+"""Hardware-aware tuning of n_threads, n_batch and n_ctx for llama-cpp
+
+At startup the container's cgroup CPU quota, memory limit and CPU features
+are detected. A short calibration sweep then times a representative request
+for each (n_threads, n_batch) candidate and keeps the fastest. The decision
+is cached per host fingerprint and model file, so restarts skip the sweep.
+Pods sharing the cache file take a lock around calibrate-and-save, so they
+calibrate one at a time instead of timing each other's load.
+"""
+import fcntl
+import hashlib
+import json
+import math
+import os
+import platform
+import time
+
+import config
+
+CALIBRATION_PROMPT = ("[INST] Write a Python function that parses a CSV file of orders, "
+                      "groups them by customer and returns the total amount per customer. "
+                      "Include type hints and a docstring. [/INST]")
+FEATURE_FLAGS = ('avx', 'avx2', 'avx512f', 'avx512_vnni', 'avx_vnni', 'fma', 'f16c', 'neon', 'asimd')
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def detect_cpu_quota():
+    """CPUs available to this container (cgroup v2/v1 quota, then affinity)"""
+    cpu_max = _read('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max':
+            return int(quota) / int(period)
+    quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    if hasattr(os, 'sched_getaffinity'):
+        return float(len(os.sched_getaffinity(0)))
+    return float(os.cpu_count() or 1)
+
+def detect_memory_limit():
+    """Bytes of memory available to this container (cgroup limit, then physical RAM)"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read(path)
+        # cgroup v1 reports "unlimited" as a huge page-aligned number
+        if value and value != 'max' and int(value) < 1 << 60:
+            return int(value)
+    meminfo = _read('/proc/meminfo') or ''
+    for line in meminfo.splitlines():
+        if line.startswith('MemTotal:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+def detect_cpu_features():
+    """SIMD features relevant to llama.cpp kernels, plus the CPU model name"""
+    cpuinfo = _read('/proc/cpuinfo') or ''
+    flags, model = set(), platform.processor() or platform.machine()
+    for line in cpuinfo.splitlines():
+        key, _, value = line.partition(':')
+        key = key.strip().lower()
+        if key in ('flags', 'features'):
+            flags.update(value.split())
+        elif key == 'model name':
+            model = value.strip()
+    return model, sorted(f for f in FEATURE_FLAGS if f in flags)
+
+def hardware_profile():
+    cpu_model, features = detect_cpu_features()
+    return {
+        'cpu_quota': round(detect_cpu_quota(), 2),
+        'memory_limit_bytes': detect_memory_limit(),
+        'cpu_model': cpu_model,
+        'cpu_features': features,
+        'machine': platform.machine()
+    }
+
+def choose_context(requested_ctx, model_path, memory_limit):
+    """Largest n_ctx (<= requested) whose KV cache fits beside the model weights
+
+    The KV cache for a 7B Q4 model is ~0.5MB per token; scale that by the
+    model file size as a rough proxy for layer count x embedding width.
+    """
+    if not memory_limit or not os.path.exists(model_path):
+        return requested_ctx
+    model_bytes = os.path.getsize(model_path)
+    kv_per_token = 0.5 * 1024 * 1024 * model_bytes / (4 * 1024 ** 3)
+    budget = memory_limit * 0.9 - model_bytes - 512 * 1024 * 1024
+    fits = int(budget / kv_per_token) // 256 * 256
+    return max(512, min(requested_ctx, fits))
+
+def candidate_threads(cpu_quota):
+    """Thread counts worth timing: the quota, one less, and half of it"""
+    quota = max(1, int(math.ceil(cpu_quota)))
+    return sorted({quota, max(1, quota - 1), max(1, quota // 2)})
+
+def _fingerprint(model_path, hardware, n_ctx):
+    stat = os.stat(model_path)
+    key = json.dumps([hardware, os.path.basename(model_path), stat.st_size, n_ctx],
+                     sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+def _load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _lock_cache(path):
+    """Exclusive flock shared by every process using this cache file"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    handle = open(path + '.lock', 'w')
+    fcntl.flock(handle, fcntl.LOCK_EX)
+    return handle
+
+def _save_cache(path, cache):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"⚠️  Could not write autotune cache {path}: {e}")
+
+def calibrate(model_path, n_ctx, threads, batches, max_tokens=32):
+    """Time one representative request per (n_threads, n_batch); returns the sweep"""
+    from llama_cpp import Llama
+
+    # Discarded run: the first generation also pays for faulting in the weights
+    model = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=threads[0],
+                  n_batch=batches[0], verbose=False)
+    model(CALIBRATION_PROMPT, max_tokens=max_tokens, temperature=0.0)
+    del model
+
+    sweep = []
+    for n_threads in threads:
+        for n_batch in batches:
+            # mmap keeps the weights in the page cache, so reloading is cheap
+            model = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
+                          n_batch=n_batch, verbose=False)
+            start = time.time()
+            response = model(CALIBRATION_PROMPT, max_tokens=max_tokens, temperature=0.0)
+            elapsed = time.time() - start
+            del model
+
+            tokens = response['usage']['completion_tokens']
+            sweep.append({
+                'n_threads': n_threads,
+                'n_batch': n_batch,
+                'seconds': round(elapsed, 3),
+                'tokens_per_second': round(tokens / elapsed, 2) if elapsed > 0 else 0.0
+            })
+            print(f"   n_threads={n_threads:2d} n_batch={n_batch:4d} -> "
+                  f"{sweep[-1]['tokens_per_second']:.2f} tokens/s")
+    return sweep
+
+def tune(model_path, n_ctx=None, n_threads=None, n_batch=512):
+    """Pick llama-cpp settings for this host; returns the decision dict
+
+    Without AUTOTUNE the configured values are returned unchanged.
+    """
+    n_ctx = n_ctx or config.MODEL_CONTEXT_SIZE
+    n_threads = n_threads or config.MODEL_THREADS
+    if not config.AUTOTUNE:
+        return {'source': 'config', 'n_threads': n_threads, 'n_batch': n_batch, 'n_ctx': n_ctx}
+
+    hardware = hardware_profile()
+    n_ctx = choose_context(n_ctx, model_path, hardware['memory_limit_bytes'])
+    key = _fingerprint(model_path, hardware, n_ctx)
+    cache = _load_cache(config.AUTOTUNE_CACHE_PATH)
+    if key in cache:
+        decision = {**cache[key], 'source': 'cache', 'hardware': hardware}
+        print(f"✅ Autotune: cached n_threads={decision['n_threads']} "
+              f"n_batch={decision['n_batch']} n_ctx={decision['n_ctx']}")
+        return decision
+
+    with _lock_cache(config.AUTOTUNE_CACHE_PATH):
+        # Another pod on this node may have calibrated while we waited
+        cache = _load_cache(config.AUTOTUNE_CACHE_PATH)
+        if key in cache:
+            decision = {**cache[key], 'source': 'cache', 'hardware': hardware}
+            print(f"✅ Autotune: n_threads={decision['n_threads']} n_batch={decision['n_batch']} "
+                  f"n_ctx={decision['n_ctx']} (calibrated by another process)")
+            return decision
+
+        threads = candidate_threads(hardware['cpu_quota'])
+        batches = config.AUTOTUNE_BATCH_SIZES
+        print(f"🔧 Autotune: {hardware['cpu_quota']} CPUs, "
+              f"{(hardware['memory_limit_bytes'] or 0) / 1024 ** 3:.1f}GB, "
+              f"features {','.join(hardware['cpu_features']) or 'none'}; "
+              f"sweeping threads {threads} x batch {batches}")
+        sweep = calibrate(model_path, n_ctx, threads, batches)
+        best = max(sweep, key=lambda r: r['tokens_per_second'])
+
+        decision = {
+            'n_threads': best['n_threads'],
+            'n_batch': best['n_batch'],
+            'n_ctx': n_ctx,
+            'tokens_per_second': best['tokens_per_second'],
+            'sweep': sweep,
+            'tuned_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        }
+        # Re-read under the lock so entries other hosts added are kept
+        cache = _load_cache(config.AUTOTUNE_CACHE_PATH)
+        cache[key] = decision
+        _save_cache(config.AUTOTUNE_CACHE_PATH, cache)
+    print(f"✅ Autotune: picked n_threads={decision['n_threads']} n_batch={decision['n_batch']} "
+          f"({decision['tokens_per_second']:.2f} tokens/s)")
+    return {**decision, 'source': 'calibrated', 'hardware': hardware}
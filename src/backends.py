@@ -0,0 +1,120 @@
+"""Backend protocol and factory
+
+Every inference backend (llama-cpp, Ollama, mock, and the out-of-process
+worker that wraps any of them) implements Backend, so app.py only talks to
+this interface and picks an implementation with load_backend().
+"""
+import zlib
+
+BACKENDS = ('llama-cpp', 'ollama', 'mock')
+
+class Backend:
+    """Interface implemented by every inference backend
+
+    generate() returns a llama-cpp style completion
+    ({'choices': [{'text', 'finish_reason'}], 'usage': {...}}) and stream()
+    yields llama-cpp style chunks, the last of which carries the
+    finish_reason. Both honour response_format, stop and limits
+    (generation.GenerationLimits).
+    """
+    name = 'unknown'
+    tuning = None  # llama-cpp settings actually in use (see autotune.tune)
+
+    def generate(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+                 stop=None, limits=None):
+        raise NotImplementedError
+
+    def stream(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+               stop=None, limits=None):
+        """Yield completion chunks; by default the whole completion as one chunk"""
+        choice = self.generate(prompt, max_tokens, temperature, response_format=response_format,
+                               stop=stop, limits=limits)['choices'][0]
+        yield completion_chunk(choice['text'], choice.get('finish_reason', 'stop'))
+
+    def tokenize(self, text):
+        """Token ids for text
+
+        Backends without access to the model's tokenizer approximate one id
+        per whitespace-separated word (see capabilities()['exact_tokenizer']).
+        """
+        return [zlib.crc32(word.encode('utf-8')) for word in text.split()]
+
+    def embed(self, text):
+        """Embedding vector for text; only backends with capabilities()['embed']"""
+        raise NotImplementedError(f"{self.name} backend does not support embeddings")
+
+    def health(self):
+        """{'status': 'healthy' | 'restarting' | 'unavailable', ...}"""
+        return {'status': 'healthy'}
+
+    def capabilities(self):
+        """What this backend supports, for /health and callers that adapt to it"""
+        return {
+            'stream': True,
+            'grammar': False,
+            'json_schema': False,
+            'embed': False,
+            'exact_tokenizer': False,
+            'slots': 1,
+            'dispatcher': False,
+            'isolated': False
+        }
+
+    def upstream_info(self):
+        """Backend-specific queue metrics for /metrics, or None"""
+        return None
+
+def completion_chunk(text, finish_reason=None):
+    """One llama-cpp style streaming chunk"""
+    return {'choices': [{'text': text, 'finish_reason': finish_reason}]}
+
+def _load_mock(model_path):
+    from inference_mock import LLMInference
+    backend = LLMInference(model_path)
+    print("✅ Using mock inference engine")
+    return backend
+
+def _load_ollama(model_path):
+    from inference_ollama import LLMInference
+    backend = LLMInference()
+    print("✅ Using Ollama inference engine")
+    return backend
+
+def _load_llama_cpp(model_path):
+    import config
+    from inference import LLMInference
+    from autotune import tune
+    tuning = tune(model_path, config.MODEL_CONTEXT_SIZE, config.MODEL_THREADS,
+                  config.MODEL_BATCH_SIZE)
+    backend = LLMInference(model_path, n_ctx=tuning['n_ctx'], n_threads=tuning['n_threads'],
+                           n_batch=tuning['n_batch'])
+    backend.tuning = tuning
+    print("✅ Using llama-cpp-python inference engine")
+    return backend
+
+_LOADERS = {
+    'llama-cpp': _load_llama_cpp,
+    'ollama': _load_ollama,
+    'mock': _load_mock
+}
+
+def load_backend(kind, model_path, worker=False):
+    """Create the backend named kind ('llama-cpp', 'ollama' or 'mock')
+
+    worker=True runs it in a supervised child process (see worker.py) so a
+    crash or hang in the model cannot take the API down. A backend whose
+    package is not installed falls back to the mock.
+    """
+    if kind not in _LOADERS:
+        raise ValueError(f"Unknown backend {kind!r}; expected one of {', '.join(BACKENDS)}")
+    if worker:
+        from worker import WorkerBackend
+        return WorkerBackend(kind, model_path)
+    try:
+        return _LOADERS[kind](model_path)
+    except ImportError as e:
+        if kind == 'mock':
+            raise
+        print(f"❌ Error loading inference engine: {e}")
+        print("📝 Falling back to mock inference for testing")
+        return _load_mock(model_path)
@@ -5,33 +5,104 @@ import os
 MODEL_PATH = os.environ.get('MODEL_PATH', 'models/llama-3.2-3b-q4.gguf')
 MODEL_CONTEXT_SIZE = int(os.environ.get('MODEL_CONTEXT_SIZE', '2048'))
 MODEL_THREADS = int(os.environ.get('MODEL_THREADS', '4'))
+MODEL_BATCH_SIZE = int(os.environ.get('MODEL_BATCH_SIZE', '512'))
+
+# Auto-tune n_threads/n_batch/n_ctx to the container's CPU quota and memory limit
+AUTOTUNE = os.environ.get('AUTOTUNE', 'false').lower() == 'true'
+AUTOTUNE_CACHE_PATH = os.environ.get('AUTOTUNE_CACHE_PATH', 'models/.autotune.json')
+AUTOTUNE_BATCH_SIZES = [int(b) for b in os.environ.get('AUTOTUNE_BATCH_SIZES', '128,256,512').split(',')]
+
+# Backend: 'llama-cpp', 'ollama' or 'mock' ('' = chosen from USE_MOCK/USE_OLLAMA/platform)
+BACKEND = os.environ.get('BACKEND', '')
+# Run the backend in a supervised child process, restarted if it crashes or stalls
+BACKEND_WORKER = os.environ.get('BACKEND_WORKER', 'false').lower() == 'true'
+WORKER_START_TIMEOUT = float(os.environ.get('WORKER_START_TIMEOUT', '600'))
+WORKER_REQUEST_TIMEOUT = float(os.environ.get('WORKER_REQUEST_TIMEOUT', '300'))
+WORKER_HEARTBEAT_TIMEOUT = float(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '15'))
+WORKER_MAX_RETRIES = int(os.environ.get('WORKER_MAX_RETRIES', '1'))
+
+# Admission queue in front of the backend: 0 = one slot per backend slot
+# (not used for Ollama, whose dispatcher queues and coalesces calls itself)
+ADMISSION_SLOTS = int(os.environ.get('ADMISSION_SLOTS', '0'))
+# Opt-in: learn output lengths online and admit shortest predicted jobs first
+# (better median, worse p95/p99; FIFO when false)
+LENGTH_PREDICTOR = os.environ.get('LENGTH_PREDICTOR', 'false').lower() == 'true'
+LENGTH_PREDICTOR_DIM = int(os.environ.get('LENGTH_PREDICTOR_DIM', '4096'))
+# Predicted seconds a queued job gains per second waited, so long jobs never starve
+SCHEDULER_AGING = float(os.environ.get('SCHEDULER_AGING', '0.1'))
+
+# Ollama backend: must match the server's OLLAMA_NUM_PARALLEL
+OLLAMA_NUM_PARALLEL = int(os.environ.get('OLLAMA_NUM_PARALLEL', '1'))
 
 # API Configuration
 API_HOST = os.environ.get('API_HOST', '0.0.0.0')
 API_PORT = int(os.environ.get('API_PORT', '8080'))
 
+# Frontend: served from memory by the API, or by src/static_server.py when false
+SERVE_FRONTEND = os.environ.get('SERVE_FRONTEND', 'true').lower() == 'true'
+STATIC_PORT = int(os.environ.get('STATIC_PORT', '8081'))
+
+# Response compression (gzip, or zstd if the zstandard package is installed)
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', '3'))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '32'))
+
+# Audit log of every prompt and completion (gzip JSONL, written off the request path)
+AUDIT_LOG_ENABLED = os.environ.get('AUDIT_LOG_ENABLED', 'false').lower() == 'true'
+AUDIT_LOG_DIR = os.environ.get('AUDIT_LOG_DIR', 'logs/audit')
+AUDIT_LOG_BUFFER = int(os.environ.get('AUDIT_LOG_BUFFER', '10000'))
+AUDIT_LOG_BATCH = int(os.environ.get('AUDIT_LOG_BATCH', '256'))
+AUDIT_LOG_FLUSH_SECONDS = float(os.environ.get('AUDIT_LOG_FLUSH_SECONDS', '1.0'))
+AUDIT_LOG_MAX_MB = int(os.environ.get('AUDIT_LOG_MAX_MB', '64'))
+AUDIT_LOG_COMPRESS = os.environ.get('AUDIT_LOG_COMPRESS', 'true').lower() == 'true'
+
+# Traffic-shape trace for tests/replay.py (no prompt or response text; same writer as the audit log)
+TRACE_CAPTURE = os.environ.get('TRACE_CAPTURE', 'false').lower() == 'true'
+TRACE_DIR = os.environ.get('TRACE_DIR', 'logs/trace')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+
 # Default Generation Parameters
 DEFAULT_MAX_TOKENS = int(os.environ.get('DEFAULT_MAX_TOKENS', '150'))
 DEFAULT_TEMPERATURE = float(os.environ.get('DEFAULT_TEMPERATURE', '0.7'))
 
 # Model configurations for different scenarios
+# 'sha256' pins the exact file. When it is None, model_fetch verifies against
+# the sha256 Hugging Face publishes for the URL (X-Linked-Etag) instead, so
+# every download is checked; MODEL_SHA256 overrides both.
 MODEL_CONFIGS = {
+    'codellama-7b-instruct': {
+        'filename': 'codellama-7b-instruct-q4.gguf',
+        'url': 'https://huggingface.co/TheBloke/CodeLlama-7B-Instruct-GGUF/resolve/main/codellama-7b-instruct.Q4_K_M.gguf',
+        'size_gb': 4.1,
+        'recommended_ram': '8GB',
+        'recommended_threads': 4,
+        'sha256': None
+    },
     'llama-3.2-3b': {
         'filename': 'llama-3.2-3b-q4.gguf',
         'url': 'https://huggingface.co/bartowski/Llama-3.2-3B-Instruct-GGUF/resolve/main/Llama-3.2-3B-Instruct-Q4_K_M.gguf',
         'size_gb': 2.0,
         'recommended_ram': '4GB',
-        'recommended_threads': 4
+        'recommended_threads': 4,
+        'sha256': None
     },
     'llama-3.1-8b': {
         'filename': 'llama-3.1-8b-q4.gguf',
         'url': 'https://huggingface.co/bartowski/Llama-3.1-8B-Instruct-GGUF/resolve/main/Llama-3.1-8B-Instruct-Q4_K_M.gguf',
         'size_gb': 4.5,
         'recommended_ram': '8GB',
-        'recommended_threads': 8
+        'recommended_threads': 8,
+        'sha256': None
     }
 }
 
+# Model fetch: content-addressed cache shared by all pods on a node
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', 'models/.cache')
+MODEL_SHA256 = os.environ.get('MODEL_SHA256') or None
+MODEL_FETCH_WORKERS = int(os.environ.get('MODEL_FETCH_WORKERS', '8'))
+MODEL_FETCH_CHUNK_MB = int(os.environ.get('MODEL_FETCH_CHUNK_MB', '64'))
+
 def get_model_info(model_path):
     """Get information about the currently loaded model"""
     model_name = os.path.basename(model_path)
@@ -49,3 +120,31 @@ def get_model_info(model_path):
         'path': model_path,
         'filename': model_name
     }
+
+# Mock backend cost model (seconds per token, fitted from llama-cpp runs
+# of llama-3.2-3b Q4_K_M on 4 vCPUs; refit with scripts/fit_mock_profile.py)
+MOCK_LOAD_TIME = float(os.environ.get('MOCK_LOAD_TIME', '0.5'))
+MOCK_REQUEST_OVERHEAD = float(os.environ.get('MOCK_REQUEST_OVERHEAD', '0.02'))
+MOCK_PROMPT_EVAL_PER_TOKEN = float(os.environ.get('MOCK_PROMPT_EVAL_PER_TOKEN', '0.008'))
+MOCK_DECODE_PER_TOKEN = float(os.environ.get('MOCK_DECODE_PER_TOKEN', '0.045'))
+MOCK_OUTPUT_TOKENS = int(os.environ.get('MOCK_OUTPUT_TOKENS', '120'))
+MOCK_JITTER = float(os.environ.get('MOCK_JITTER', '0.05'))
+MOCK_SLOTS = int(os.environ.get('MOCK_SLOTS', '1'))
+MOCK_FAILURE_RATE = float(os.environ.get('MOCK_FAILURE_RATE', '0.0'))
+MOCK_SPIKE_RATE = float(os.environ.get('MOCK_SPIKE_RATE', '0.0'))
+# Spread of output length by prompt: each prompt's leading word scales the mean
+# length by up to e**skew either way (0 = length independent of the prompt)
+MOCK_LENGTH_SKEW = float(os.environ.get('MOCK_LENGTH_SKEW', '0.0'))
+MOCK_SPIKE_SECONDS = float(os.environ.get('MOCK_SPIKE_SECONDS', '2.0'))
+MOCK_SEED = os.environ.get('MOCK_SEED')
+MOCK_SEED = int(MOCK_SEED) if MOCK_SEED is not None else None
+
+# Structured output: compiled grammars kept in memory, keyed by schema hash
+GRAMMAR_CACHE_SIZE = int(os.environ.get('GRAMMAR_CACHE_SIZE', '64'))
+
+# Semantic cache: serve near-duplicate prompts from earlier answers
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.9'))
+SEMANTIC_CACHE_MAX_MB = int(os.environ.get('SEMANTIC_CACHE_MAX_MB', '64'))
+# 'hashing' (no model needed), 'backend' (backend embed()), or a path to a GGUF embedding model
+SEMANTIC_CACHE_EMBEDDER = os.environ.get('SEMANTIC_CACHE_EMBEDDER', 'hashing')
@@ -0,0 +1,244 @@
+"""Client-side dispatcher for a model server with a fixed number of parallel slots
+
+Caps concurrent upstream calls at the server's slot count and hands free
+slots to waiting callers strictly in arrival order. Identical requests that
+are already queued or running are merged into a single upstream call.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from generation import GenerationAborted
+
+class QueueTimeout(GenerationAborted):
+    """The request's wall-clock budget ran out before an upstream slot freed up"""
+    status_code = 504
+
+class _Call:
+    """One upstream call shared by a leader and any merged followers"""
+
+    def __init__(self):
+        self.started = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+class _Ticket:
+    """One caller's place in a SlotQueue"""
+
+    def __init__(self, cost=None):
+        self.cost = cost
+        self.arrived = time.time()
+        self.started = None
+        self.turn = threading.Event()
+
+def _first(waiting):
+    return waiting[0]
+
+class SlotQueue:
+    """Counting slot limiter that hands free slots straight to waiters
+
+    choose(waiting) picks which waiting ticket gets the next free slot (the
+    list is in arrival order, so the default is FIFO); it runs under the
+    queue's lock. Waiters honour GenerationLimits while queued.
+    """
+
+    def __init__(self, slots=1, choose=None, poll_interval=0.05):
+        self.slots = max(1, slots)
+        self.choose = choose or _first
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._running = set()
+        self._free = self.slots
+
+        self.stats = {
+            'admitted': 0,
+            'queue_timeouts': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0
+        }
+
+    def acquire(self, limits=None, cost=None, message="Request budget expired while queued for a slot"):
+        """Wait for a slot; returns the ticket to pass to release()"""
+        ticket = _Ticket(cost)
+        with self._lock:
+            if self._free and not self._waiting:
+                self._free -= 1
+                self._start(ticket)
+                return ticket
+            self._waiting.append(ticket)
+
+        while not ticket.turn.wait(self.poll_interval):
+            if limits is not None and limits.check(0) is not None:
+                with self._lock:
+                    handed_over = ticket.turn.is_set()
+                    if not handed_over:
+                        self._waiting.remove(ticket)
+                        self.stats['queue_timeouts'] += 1
+                if handed_over:
+                    # The slot arrived just as the limit fired; pass it on
+                    self.release(ticket)
+                limits.raise_if_fatal()
+                raise QueueTimeout(message)
+        with self._lock:
+            self._start(ticket)
+        return ticket
+
+    def _start(self, ticket):
+        """Caller holds _lock"""
+        ticket.started = time.time()
+        waited = ticket.started - ticket.arrived
+        self._running.add(ticket)
+        self.stats['admitted'] += 1
+        self.stats['queue_wait_total'] += waited
+        self.stats['queue_wait_max'] = max(self.stats['queue_wait_max'], waited)
+
+    def release(self, ticket):
+        with self._lock:
+            self._running.discard(ticket)
+            if self._waiting:
+                # Hand the slot straight to the chosen waiter; _free is unchanged
+                chosen = self.choose(self._waiting)
+                self._waiting.remove(chosen)
+                chosen.turn.set()
+            else:
+                self._free += 1
+
+    def snapshot(self):
+        """(running, waiting) tickets, for estimates built on their costs"""
+        with self._lock:
+            return list(self._running), list(self._waiting)
+
+    @property
+    def queue_depth(self):
+        return len(self._waiting)
+
+    def info(self):
+        """Queue metrics for /metrics"""
+        with self._lock:
+            admitted = self.stats['admitted']
+            return {
+                'slots': self.slots,
+                'running': len(self._running),
+                'queue_depth': len(self._waiting),
+                'queue_timeouts': self.stats['queue_timeouts'],
+                'queue_wait_avg_seconds': round(self.stats['queue_wait_total'] / admitted, 3) if admitted else 0.0,
+                'queue_wait_max_seconds': round(self.stats['queue_wait_max'], 3)
+            }
+
+class UpstreamDispatcher:
+    """Fair FIFO slot limiter with in-flight request coalescing"""
+
+    def __init__(self, max_concurrent=1, poll_interval=0.05):
+        self.max_concurrent = max(1, max_concurrent)
+        self.poll_interval = poll_interval
+        self._slots = SlotQueue(max_concurrent, poll_interval=poll_interval)
+        self._lock = threading.Lock()
+        self._calls = {}  # coalescing key -> _Call
+
+        self.stats = {
+            'upstream_calls': 0,
+            'coalesced': 0
+        }
+
+    def _acquire(self, limits):
+        """Wait for a free slot in arrival order; honours limits while queued"""
+        return self._slots.acquire(limits, message="Request budget expired while queued upstream")
+
+    @contextmanager
+    def slot(self, limits=None):
+        """Hold one upstream slot for the duration of a with block, without merging
+
+        Used for streamed calls, whose chunks cannot be shared between callers.
+        """
+        ticket = self._acquire(limits)
+        if limits is not None:
+            limits.queue_wait += ticket.started - ticket.arrived
+        try:
+            with self._lock:
+                self.stats['upstream_calls'] += 1
+            yield
+        finally:
+            self._slots.release(ticket)
+
+    def submit(self, fn, key=None, limits=None):
+        """Run fn() within the slot limit, merging with an identical in-flight call
+
+        key identifies requests whose results are interchangeable; None
+        disables merging. If the leader of a merged call aborts (e.g. its
+        client disconnected), followers retry on their own. The time until
+        the upstream call serving this caller started is added to
+        limits.queue_wait.
+        """
+        arrived = time.time()
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                return self._lead(call, key, fn, limits, arrived)
+
+            while not call.done.wait(self.poll_interval):
+                if limits is not None and limits.check(0) is not None:
+                    limits.raise_if_fatal()
+                    raise QueueTimeout("Request budget expired while waiting on a merged call")
+            if isinstance(call.error, GenerationAborted):
+                continue
+            if call.error is not None:
+                raise call.error
+            if limits is not None:
+                # Joined while the call was queued: its wait was ours too
+                limits.queue_wait += max(0.0, call.started - arrived)
+            return call.result
+
+    def _join(self, key):
+        """Return (call, is_leader) for key"""
+        with self._lock:
+            if key is not None and key in self._calls:
+                call = self._calls[key]
+                call.followers += 1
+                self.stats['coalesced'] += 1
+                return call, False
+            call = _Call()
+            if key is not None:
+                self._calls[key] = call
+            return call, True
+
+    def _lead(self, call, key, fn, limits, arrived):
+        try:
+            ticket = self._acquire(limits)
+            call.started = ticket.started
+            if limits is not None:
+                limits.queue_wait += ticket.started - arrived
+            try:
+                with self._lock:
+                    self.stats['upstream_calls'] += 1
+                call.result = fn()
+            finally:
+                self._slots.release(ticket)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if key is not None and self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def info(self):
+        """Upstream queue metrics for /metrics"""
+        queue = self._slots.info()
+        with self._lock:
+            calls = self.stats['upstream_calls']
+            coalesced = self.stats['coalesced']
+        return {
+            'max_concurrent': self.max_concurrent,
+            'running': queue['running'],
+            'queue_depth': queue['queue_depth'],
+            'upstream_calls': calls,
+            'coalesced': coalesced,
+            'queue_timeouts': queue['queue_timeouts'],
+            'queue_wait_avg_seconds': queue['queue_wait_avg_seconds'],
+            'queue_wait_max_seconds': queue['queue_wait_max_seconds']
+        }
@@ -0,0 +1,180 @@
+"""Per-request generation limits: stop sequences, time budgets and cancellation"""
+import select
+import socket
+import threading
+import time
+
+# Stop list used when a request does not supply its own
+DEFAULT_STOP = ["</s>", "User:", "\n\n"]
+MAX_STOP_SEQUENCES = 8
+MAX_STOP_LENGTH = 64
+
+class GenerationAborted(Exception):
+    """Generation ended before producing a usable response"""
+    status_code = 500
+
+class FirstTokenTimeout(GenerationAborted):
+    """No token was produced within the request's max_ttft_seconds"""
+    status_code = 504
+
+class GenerationCancelled(GenerationAborted):
+    """The client went away, so generation was abandoned"""
+    status_code = 499
+
+def parse_stop(stop):
+    """Validate a request-level stop value; returns a list or None for the default"""
+    if stop is None:
+        return None
+    if isinstance(stop, str):
+        stop = [stop]
+    if not isinstance(stop, list) or not all(isinstance(s, str) and s for s in stop):
+        raise ValueError("stop must be a string or a list of non-empty strings")
+    if len(stop) > MAX_STOP_SEQUENCES:
+        raise ValueError(f"stop accepts at most {MAX_STOP_SEQUENCES} sequences")
+    if any(len(s) > MAX_STOP_LENGTH for s in stop):
+        raise ValueError(f"stop sequences must be at most {MAX_STOP_LENGTH} characters")
+    return stop
+
+def parse_seconds(value, name):
+    """Validate an optional positive number of seconds"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError(f"{name} must be a positive number of seconds")
+    return float(value)
+
+def parse_max_tokens(value, default):
+    """Validate an optional positive integer token count"""
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError("max_tokens must be a positive integer")
+    return value
+
+def parse_temperature(value, default):
+    """Validate an optional non-negative sampling temperature"""
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError("temperature must be a non-negative number")
+    return float(value)
+
+def truncate_at_stop(text, stop):
+    """Cut text at the earliest stop sequence; returns (text, stopped)"""
+    cut = min((i for i in (text.find(s) for s in stop or []) if i >= 0), default=-1)
+    if cut < 0:
+        return text, False
+    return text[:cut], True
+
+class GenerationLimits:
+    """Wall-clock budget, time-to-first-token limit and cancellation for one request
+
+    Backends call check() between tokens; it returns the reason generation
+    must end ('cancelled', 'first_token_timeout', 'time_limit') or None.
+    Backends that queue for an upstream slot add the time spent waiting to
+    queue_wait, so callers can tell it apart from service time.
+    """
+
+    def __init__(self, start_time=None, timeout_seconds=None, max_ttft_seconds=None,
+                 cancel_event=None):
+        start_time = time.time() if start_time is None else start_time
+        self.deadline = start_time + timeout_seconds if timeout_seconds else None
+        self.first_token_deadline = start_time + max_ttft_seconds if max_ttft_seconds else None
+        self.cancel_event = cancel_event or threading.Event()
+        self.reason = None
+        self.queue_wait = 0.0
+
+    def check(self, tokens_generated):
+        """Return why generation must stop now, or None to keep going"""
+        now = time.time()
+        if self.cancel_event.is_set():
+            self.reason = 'cancelled'
+        elif tokens_generated == 0 and self.first_token_deadline and now > self.first_token_deadline:
+            self.reason = 'first_token_timeout'
+        elif self.deadline and now > self.deadline:
+            self.reason = 'time_limit'
+        return self.reason
+
+    def time_left(self, tokens_generated=0):
+        """Seconds until the nearest applicable deadline, or None if unbounded"""
+        deadlines = [d for d in (self.deadline,
+                                 self.first_token_deadline if tokens_generated == 0 else None) if d]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.time())
+
+    def raise_if_fatal(self):
+        """Turn an abort that left no usable output into an exception"""
+        if self.reason == 'cancelled':
+            raise GenerationCancelled("Client disconnected; generation aborted")
+        if self.reason == 'first_token_timeout':
+            raise FirstTokenTimeout("No token produced within max_ttft_seconds")
+
+class LimitStopCriteria:
+    """llama-cpp stopping criterion that enforces GenerationLimits between tokens"""
+
+    def __init__(self, limits, n_prompt_tokens):
+        self.limits = limits
+        self.n_prompt_tokens = n_prompt_tokens
+
+    def __call__(self, input_ids, logits):
+        # Runs right after sampling, before the new token is appended to input_ids
+        return self.limits.check(len(input_ids) - self.n_prompt_tokens) is not None
+
+class DisconnectMonitor:
+    """Background poller that flags requests whose client closed the connection
+
+    A closed TCP connection becomes readable and a peek returns b''. Sockets
+    that become readable with real data (pipelined requests) are dropped from
+    polling, since they can no longer be told apart.
+    """
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def socket_for(environ):
+        """The client socket from a WSGI environ (werkzeug or gunicorn), if exposed"""
+        sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+        return sock if isinstance(sock, socket.socket) else None
+
+    def watch(self, sock, event):
+        with self._lock:
+            self._watched[sock] = event
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='disconnect-monitor',
+                                                daemon=True)
+                self._thread.start()
+
+    def unwatch(self, sock):
+        with self._lock:
+            self._watched.pop(sock, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                socks = [s for s in self._watched if s.fileno() >= 0]
+            if not socks:
+                time.sleep(self.interval)
+                continue
+            try:
+                readable, _, _ = select.select(socks, [], [], self.interval)
+            except (OSError, ValueError):
+                time.sleep(self.interval)
+                continue
+            for sock in readable:
+                try:
+                    closed = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    closed = True
+                with self._lock:
+                    event = self._watched.pop(sock, None)
+                if event is not None and closed:
+                    event.set()
+
+disconnect_monitor = DisconnectMonitor()
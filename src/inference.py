@@ -1,10 +1,14 @@
 """Model loading and inference logic"""
-from llama_cpp import Llama
+from llama_cpp import Llama, StoppingCriteriaList
 import os
 import time
 
-class LLMInference:
-    def __init__(self, model_path, n_ctx=2048, n_threads=4):
+from backends import Backend, completion_chunk
+from generation import DEFAULT_STOP, LimitStopCriteria
+from structured import get_grammar, is_json_format, trim_to_structure, JsonStopCriteria
+
+class LLMInference(Backend):
+    def __init__(self, model_path, n_ctx=2048, n_threads=4, n_batch=512):
         """Initialize the LLM model"""
         print(f"Loading model from {model_path}...")
         start = time.time()
@@ -13,18 +17,87 @@ class LLMInference:
             model_path=model_path,
             n_ctx=n_ctx,
             n_threads=n_threads,
+            n_batch=n_batch,
             verbose=False
         )
 
+        self.name = os.path.basename(model_path)
+
         load_time = time.time() - start
         print(f"Model loaded in {load_time:.2f}s")
 
-    def generate(self, prompt, max_tokens=150, temperature=0.7):
-        """Generate response from prompt"""
-        response = self.model(
-            prompt,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            stop=["</s>", "User:", "\n\n"]
-        )
+    def generate(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+                 stop=None, limits=None):
+        """Generate response from prompt
+
+        response_format (see structured.parse_response_format) constrains
+        decoding with a cached grammar and stops as soon as the structure
+        is complete. limits (generation.GenerationLimits) is checked after
+        every sampled token so budgets and client disconnects end decoding
+        immediately.
+        """
+        response = self.model(prompt, max_tokens=max_tokens, temperature=temperature,
+                              **self._decode_options(prompt, response_format, stop, limits))
+
+        choice = response['choices'][0]
+        if limits is not None and limits.reason is not None:
+            limits.raise_if_fatal()
+            choice['finish_reason'] = limits.reason
+        if is_json_format(response_format):
+            choice['text'] = trim_to_structure(choice['text'].lstrip())
         return response
+
+    def stream(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+               stop=None, limits=None):
+        """Yield llama-cpp chunks as tokens are sampled
+
+        The last chunk is held back until decoding ends so its finish_reason
+        can reflect a limit that stopped generation.
+        """
+        last = None
+        for chunk in self.model(prompt, max_tokens=max_tokens, temperature=temperature, stream=True,
+                                **self._decode_options(prompt, response_format, stop, limits)):
+            if last is not None:
+                yield last
+            last = chunk
+
+        if limits is not None and limits.reason is not None:
+            limits.raise_if_fatal()
+            if last is None:
+                last = completion_chunk('')
+            last['choices'][0]['finish_reason'] = limits.reason
+        if last is not None:
+            yield last
+
+    def tokenize(self, text):
+        return self.model.tokenize(text.encode('utf-8'), add_bos=False)
+
+    def capabilities(self):
+        return {
+            **super().capabilities(),
+            'grammar': True,
+            'json_schema': True,
+            'exact_tokenizer': True
+        }
+
+    def _decode_options(self, prompt, response_format, stop, limits):
+        """Stop list, grammar and stopping criteria shared by generate() and stream()"""
+        if stop is None:
+            # Blank lines are valid inside structured output, so only stop on EOS there
+            stop = ["</s>"] if response_format is not None else DEFAULT_STOP
+
+        criteria = []
+        if limits is not None or is_json_format(response_format):
+            n_prompt = len(self.model.tokenize(prompt.encode('utf-8')))
+            if limits is not None:
+                if limits.check(0) is not None:
+                    limits.raise_if_fatal()
+                criteria.append(LimitStopCriteria(limits, n_prompt))
+            if is_json_format(response_format):
+                criteria.append(JsonStopCriteria(self.model, n_prompt))
+
+        return {
+            'stop': stop,
+            'grammar': get_grammar(response_format) if response_format is not None else None,
+            'stopping_criteria': StoppingCriteriaList(criteria) if criteria else None
+        }
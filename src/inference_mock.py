@@ -1,24 +1,153 @@
-"""Mock LLM inference for testing without llama-cpp-python"""
+"""Mock LLM inference for testing without llama-cpp-python
+
+Latency follows a simple cost model fitted from real llama-cpp runs:
+
+    latency = overhead + prompt_tokens * prompt_eval + completion_tokens * decode
+
+Requests contend for a fixed number of slots (llama.cpp serves one request
+per context), so queueing behaviour under load matches the real service.
+Output length can depend on the prompt (MOCK_LENGTH_SKEW), failures and
+latency spikes can be injected, and a seed makes every run reproducible
+for capacity experiments in CI.
+"""
 import time
 import random
+import json
+import math
+import os
+import re
+import threading
+import zlib
+
+import config
+from backends import Backend, completion_chunk
+from generation import truncate_at_stop
 
-class LLMInference:
+class LLMInference(Backend):
     """Mock LLM that simulates responses for testing"""
 
-    def __init__(self, model_path, n_ctx=2048, n_threads=4):
-        """Initialize the mock model"""
+    def __init__(self, model_path, n_ctx=2048, n_threads=4,
+                 prompt_eval_per_token=None, decode_per_token=None,
+                 request_overhead=None, output_tokens=None, jitter=None,
+                 slots=None, failure_rate=None, spike_rate=None,
+                 spike_seconds=None, seed=None, load_time=None, length_skew=None):
+        """Initialize the mock model
+
+        Any cost-model parameter left as None falls back to the MOCK_*
+        settings in config.py.
+        """
+        def pick(value, default):
+            return default if value is None else value
+
+        self.prompt_eval_per_token = pick(prompt_eval_per_token, config.MOCK_PROMPT_EVAL_PER_TOKEN)
+        self.decode_per_token = pick(decode_per_token, config.MOCK_DECODE_PER_TOKEN)
+        self.request_overhead = pick(request_overhead, config.MOCK_REQUEST_OVERHEAD)
+        self.output_tokens = pick(output_tokens, config.MOCK_OUTPUT_TOKENS)
+        self.jitter = pick(jitter, config.MOCK_JITTER)
+        self.slots = max(1, pick(slots, config.MOCK_SLOTS))
+        self.failure_rate = pick(failure_rate, config.MOCK_FAILURE_RATE)
+        self.spike_rate = pick(spike_rate, config.MOCK_SPIKE_RATE)
+        self.spike_seconds = pick(spike_seconds, config.MOCK_SPIKE_SECONDS)
+        self.length_skew = pick(length_skew, config.MOCK_LENGTH_SKEW)
+        self.seed = pick(seed, config.MOCK_SEED)
+
+        self._rng = random.Random(self.seed)
+        self._rng_lock = threading.Lock()
+        self._slot_pool = threading.BoundedSemaphore(self.slots)
+        self.name = f"mock:{os.path.basename(model_path)}"
+
         print(f"Loading mock model from {model_path}...")
         start = time.time()
-        time.sleep(0.5)  # Simulate loading time
+        time.sleep(pick(load_time, config.MOCK_LOAD_TIME))  # Simulate loading time
         load_time = time.time() - start
         print(f"Mock model loaded in {load_time:.2f}s")
+        print(f"   Cost model: {self.prompt_eval_per_token * 1000:.1f}ms/prompt token, "
+              f"{self.decode_per_token * 1000:.1f}ms/output token, {self.slots} slot(s)")
         print("⚠️  WARNING: Using mock LLM for testing!")
         print("   To use real LLM: pip install llama-cpp-python && download models")
 
-    def generate(self, prompt, max_tokens=150, temperature=0.7):
-        """Generate mock response"""
-        # Simulate processing time
-        time.sleep(random.uniform(0.3, 0.8))
+    def _mean_length(self, prompt):
+        """Mean output length for a prompt, skewed by its leading word (MOCK_LENGTH_SKEW)"""
+        if not self.length_skew:
+            return self.output_tokens
+        words = [w for w in re.findall(r"[a-z]+", prompt.lower()) if w != 'inst']
+        position = zlib.crc32(words[0].encode('utf-8')) % 1001 / 500 - 1 if words else 0.0
+        return self.output_tokens * math.exp(self.length_skew * position)
+
+    def _draw(self, prompt):
+        """Draw all random decisions for one request under the RNG lock"""
+        mean_length = self._mean_length(prompt)
+        with self._rng_lock:
+            low = max(1, int(mean_length * 0.5))
+            high = max(low, int(mean_length * 1.5))
+            return {
+                'length': self._rng.randint(low, high),
+                'scale': max(0.0, self._rng.gauss(1.0, self.jitter)),
+                'fail': self._rng.random() < self.failure_rate,
+                'spike': self._rng.random() < self.spike_rate
+            }
+
+    def _sleep(self, seconds, limits, tokens_generated):
+        """Sleep in short steps so limits are honoured mid-request; returns abort reason"""
+        end = time.time() + seconds
+        while True:
+            if limits is not None and limits.check(tokens_generated) is not None:
+                return limits.reason
+            remaining = end - time.time()
+            if remaining <= 0:
+                return None
+            time.sleep(min(remaining, 0.05))
+
+    def generate(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+                 stop=None, limits=None):
+        """Generate mock response
+
+        JSON response formats wrap the text in {"response": ...} (schemas
+        are not enforced, so the API only sends json_object here). Stop
+        sequences truncate the canned text, and decode time is only spent on
+        tokens actually emitted.
+        """
+        pieces = []
+        completion_tokens = 0
+        for text, tokens, finish_reason in self._decode(prompt, max_tokens, response_format,
+                                                        stop, limits):
+            pieces.append(text)
+            completion_tokens += tokens
+        prompt_tokens = len(prompt.split())
+
+        return {
+            'choices': [{'text': ''.join(pieces), 'finish_reason': finish_reason}],
+            'usage': {
+                'completion_tokens': completion_tokens,
+                'prompt_tokens': prompt_tokens,
+                'total_tokens': completion_tokens + prompt_tokens
+            }
+        }
+
+    def stream(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+               stop=None, limits=None):
+        """Yield chunks as the simulated decode progresses (~50ms apart)
+
+        JSON response formats arrive as a single chunk at the end.
+        """
+        for text, _, finish_reason in self._decode(prompt, max_tokens, response_format,
+                                                   stop, limits):
+            yield completion_chunk(text, finish_reason)
+
+    def capabilities(self):
+        # json_object output is a JSON object, but schemas and grammars are not enforced
+        return {
+            **super().capabilities(),
+            'slots': self.slots
+        }
+
+    def _decode(self, prompt, max_tokens, response_format, stop, limits):
+        """Simulate one request; yields (text, tokens, finish_reason) per decode batch
+
+        finish_reason is None on every item but the last.
+        """
+        draw = self._draw(prompt)
+        prompt_tokens = len(prompt.split())
 
         # Generate mock response based on prompt keywords
         responses = {
@@ -36,14 +165,43 @@ class LLMInference:
                 response_text = responses[key]
                 break
 
-        # Simulate token count
-        tokens = len(response_text.split())
+        # Repeat the canned text until it covers the simulated token count
+        words = response_text.split()
+        finish_reason = 'length' if max_tokens < draw['length'] else 'stop'
+        completion_tokens = min(max_tokens, draw['length'])
+        response_text = " ".join(words[i % len(words)] for i in range(completion_tokens))
+        response_text, stopped = truncate_at_stop(response_text, stop)
+        if stopped:
+            finish_reason = 'stop'
+        words = response_text.split()
+        as_json = response_format is not None and response_format['type'] != 'grammar'
 
-        return {
-            'choices': [{'text': response_text}],
-            'usage': {
-                'completion_tokens': tokens,
-                'prompt_tokens': len(prompt.split()),
-                'total_tokens': tokens + len(prompt.split())
-            }
-        }
+        # Hold a slot for the whole simulated request, like llama.cpp does
+        with self._slot_pool:
+            reason = self._sleep((self.request_overhead + prompt_tokens * self.prompt_eval_per_token)
+                                 * draw['scale'], limits, 0)
+            if reason is None and draw['fail']:
+                raise RuntimeError("Mock inference failure (injected)")
+            if reason is None and draw['spike']:
+                reason = self._sleep(self.spike_seconds, limits, 0)
+
+            emitted = 0
+            per_token = self.decode_per_token * draw['scale']
+            # Decode in ~50ms batches so limits are checked between tokens
+            batch_size = max(1, int(0.05 / per_token)) if per_token else len(words)
+            while reason is None and emitted < len(words):
+                batch = min(len(words) - emitted, batch_size)
+                reason = self._sleep(batch * per_token, limits, emitted)
+                if reason is None:
+                    if not as_json:
+                        yield (" " if emitted else "") + " ".join(words[emitted:emitted + batch]), batch, None
+                    emitted += batch
+
+        if reason is not None:
+            limits.raise_if_fatal()
+            finish_reason = reason
+
+        if as_json:
+            yield json.dumps({'response': " ".join(words[:emitted])}), emitted, finish_reason
+        else:
+            yield '', 0, finish_reason
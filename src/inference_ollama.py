@@ -1,14 +1,34 @@
 """Ollama-based LLM inference for local development on macOS"""
 import requests
+import json
 import time
+from urllib3.exceptions import ReadTimeoutError
 
-class LLMInference:
+import config
+from backends import Backend, completion_chunk
+from dispatcher import UpstreamDispatcher
+from structured import is_json_format, trim_to_structure, JsonCompletionTracker
+
+def _is_read_timeout(error):
+    """True for a read timeout, including one raised mid-stream
+
+    requests only raises ReadTimeout while waiting for the headers; once
+    iter_lines() is running it reports urllib3's ReadTimeoutError wrapped in
+    a ConnectionError.
+    """
+    if isinstance(error, requests.exceptions.ReadTimeout):
+        return True
+    return isinstance(error, requests.exceptions.ConnectionError) and any(
+        isinstance(cause, ReadTimeoutError) for cause in (*error.args, error.__context__))
+
+class LLMInference(Backend):
     """Ollama LLM inference adapter"""
 
     def __init__(self, model_path=None, n_ctx=2048, n_threads=4):
         """Initialize Ollama client"""
         self.ollama_url = "http://localhost:11434"
         self.model_name = "llama3.2:3b"  # CodeLlama for code generation
+        self.name = f"ollama:{self.model_name}"
 
         print(f"Initializing Ollama client...")
         print(f"Ollama URL: {self.ollama_url}")
@@ -38,45 +58,177 @@ class LLMInference:
             print(f"   Error details: {e}")
             raise ConnectionError("Ollama service is not running. Start with: ollama serve")
 
+        # Never send Ollama more concurrent requests than it has parallel slots
+        self.dispatcher = UpstreamDispatcher(config.OLLAMA_NUM_PARALLEL)
+
         load_time = time.time() - start
-        print(f"Ollama client initialized in {load_time:.2f}s")
+        print(f"Ollama client initialized in {load_time:.2f}s "
+              f"({config.OLLAMA_NUM_PARALLEL} parallel slot(s))")
 
-    def generate(self, prompt, max_tokens=150, temperature=0.7):
-        """Generate response using Ollama API"""
+    def upstream_info(self):
+        """Upstream queue and coalescing metrics"""
+        return self.dispatcher.info()
+
+    def embed(self, text):
+        """Embed text with the Ollama embeddings API (used by the semantic cache)"""
         try:
             response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "num_predict": max_tokens,
-                        "temperature": temperature
-                    }
-                },
-                timeout=200
+                f"{self.ollama_url}/api/embeddings",
+                json={"model": self.model_name, "prompt": text},
+                timeout=30
             )
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to connect to Ollama: {e}")
+        if response.status_code != 200:
+            raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+        return response.json()['embedding']
 
-            if response.status_code == 200:
-                data = response.json()
-                response_text = data.get('response', '')
-
-                # Estimate token counts (Ollama doesn't always provide these)
-                prompt_tokens = len(prompt.split())
-                completion_tokens = len(response_text.split())
-
-                # Format response to match llama-cpp-python structure
-                return {
-                    'choices': [{'text': response_text}],
-                    'usage': {
-                        'completion_tokens': completion_tokens,
-                        'prompt_tokens': prompt_tokens,
-                        'total_tokens': prompt_tokens + completion_tokens
-                    }
-                }
+    def health(self):
+        """Healthy while the Ollama server answers"""
+        try:
+            ok = requests.get(f"{self.ollama_url}/api/tags", timeout=2).status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        return {'status': 'healthy' if ok else 'unavailable'}
+
+    def capabilities(self):
+        return {
+            **super().capabilities(),
+            'json_schema': True,
+            'embed': True,
+            'slots': config.OLLAMA_NUM_PARALLEL,
+            'dispatcher': True
+        }
+
+    def generate(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+                 stop=None, limits=None):
+        """Generate response using Ollama API
+
+        The response is always streamed so that GenerationLimits can be
+        checked per chunk; closing the stream makes Ollama stop decoding.
+        """
+        payload = self._payload(prompt, max_tokens, temperature, response_format, stop)
+        if limits is not None and limits.check(0) is not None:
+            limits.raise_if_fatal()
+
+        # Identical requests without their own time budget can share one upstream call
+        key = None
+        if limits is None or (limits.deadline is None and limits.first_token_deadline is None):
+            key = json.dumps(payload, sort_keys=True)
+        return self.dispatcher.submit(
+            lambda: self._generate_upstream(payload, response_format, limits),
+            key=key,
+            limits=limits
+        )
+
+    def stream(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+               stop=None, limits=None):
+        """Yield chunks as Ollama produces them, holding one upstream slot throughout"""
+        payload = self._payload(prompt, max_tokens, temperature, response_format, stop)
+        if limits is not None and limits.check(0) is not None:
+            limits.raise_if_fatal()
+
+        with self.dispatcher.slot(limits):
+            yield from self._stream_upstream(payload, response_format, limits)
+
+    def _payload(self, prompt, max_tokens, temperature, response_format, stop):
+        """/api/generate request body"""
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": True,
+            "options": {
+                "num_predict": max_tokens,
+                "temperature": temperature
+            }
+        }
+        if stop is not None:
+            payload['options']['stop'] = stop
+        if response_format is not None:
+            # Ollama constrains output itself via "format": "json" or a JSON schema
+            if response_format['type'] == 'json_object':
+                payload['format'] = 'json'
+            elif response_format['type'] == 'json_schema':
+                payload['format'] = response_format['schema']
             else:
+                raise ValueError("GBNF grammars are not supported by the Ollama backend")
+        return payload
+
+    def _generate_upstream(self, payload, response_format, limits):
+        """Collect one streamed /api/generate call into a completion"""
+        pieces = []
+        finish_reason = 'stop'
+        for chunk in self._stream_upstream(payload, response_format, limits):
+            pieces.append(chunk['choices'][0]['text'])
+            finish_reason = chunk['choices'][0]['finish_reason'] or finish_reason
+
+        response_text = ''.join(pieces)
+        if is_json_format(response_format):
+            response_text = trim_to_structure(response_text.lstrip())
+
+        # Estimate token counts (Ollama doesn't always provide these)
+        prompt_tokens = len(payload['prompt'].split())
+        completion_tokens = len(response_text.split())
+
+        # Format response to match llama-cpp-python structure
+        return {
+            'choices': [{'text': response_text, 'finish_reason': finish_reason}],
+            'usage': {
+                'completion_tokens': completion_tokens,
+                'prompt_tokens': prompt_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        }
+
+    def _stream_upstream(self, payload, response_format, limits):
+        """Stream one /api/generate call as llama-cpp chunks, enforcing limits per chunk"""
+        tracker = JsonCompletionTracker() if is_json_format(response_format) else None
+        # Until the first chunk arrives the read timeout doubles as the TTFT limit
+        time_left = limits.time_left(0) if limits is not None else None
+        read_timeout = 200 if time_left is None else max(time_left, 0.01)
+
+        received = 0
+        tail = ''
+        finish_reason = 'stop'
+        try:
+            response = requests.post(
+                f"{self.ollama_url}/api/generate",
+                json=payload,
+                timeout=(10, read_timeout),
+                stream=True
+            )
+
+            if response.status_code != 200:
                 raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
 
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get('error'):
+                        raise Exception(f"Ollama API error: {data['error']}")
+                    received += 1
+                    if data.get('done'):
+                        tail = data.get('response', '')
+                        if data.get('done_reason') == 'length':
+                            finish_reason = 'length'
+                        break
+                    yield completion_chunk(data.get('response', ''))
+                    if tracker is not None and tracker.feed(data.get('response', '')):
+                        break
+                    if limits is not None and limits.check(received) is not None:
+                        finish_reason = limits.reason
+                        break
+
         except requests.exceptions.RequestException as e:
-            raise Exception(f"Failed to connect to Ollama: {e}")
+            if limits is None or not _is_read_timeout(e):
+                raise Exception(f"Failed to connect to Ollama: {e}")
+            limits.check(received)
+            if limits.reason is None:
+                limits.reason = 'first_token_timeout' if not received else 'time_limit'
+            finish_reason = limits.reason
+
+        if limits is not None and limits.reason is not None:
+            limits.raise_if_fatal()
+        yield completion_chunk(tail, finish_reason)
@@ -0,0 +1,99 @@
+"""Online output-length predictor for scheduling
+
+Predicts completion_tokens from hashed prompt features (words, prompt length,
+max_tokens, response format) with a log-linear model trained by AdaGrad after
+every request. All state is two float32 arrays of LENGTH_PREDICTOR_DIM
+entries, so prediction and update cost a few microseconds and a few KB.
+Requests cut off by max_tokens only teach the model when it predicted too
+little, since their true length is unknown.
+"""
+import math
+import re
+import threading
+import zlib
+
+import numpy as np
+
+WORD = re.compile(r"[a-z0-9_]+")
+MAX_WORDS = 64
+
+def _bucket(value):
+    """Power-of-two bucket, so nearby sizes share a feature"""
+    return int(math.log2(max(1, value)))
+
+class LengthPredictor:
+    """Log-linear regression of completion length over hashed features"""
+
+    def __init__(self, dim=4096, learning_rate=0.1, initial_tokens=50):
+        self.dim = dim
+        self.learning_rate = learning_rate
+        self.weights = np.zeros(dim, dtype=np.float32)
+        self.grad_sq = np.full(dim, 1e-3, dtype=np.float32)
+        self.bias = math.log1p(initial_tokens)
+        self.observations = 0
+        self.abs_error = None  # EWMA of |predicted - actual| tokens
+        self._lock = threading.Lock()
+
+    def features(self, prompt, max_tokens=None, response_format=None):
+        """Hashed (indices, values) for a request"""
+        words = WORD.findall(prompt.lower())
+        names = [f"w:{w}" for w in words[:MAX_WORDS]]
+        weight = 1 / math.sqrt(max(1, len(names)))
+        values = [weight] * len(names)
+        # The leading words usually say what kind of answer is wanted
+        extra = [f"lead:{' '.join(words[:2])}", f"len:{_bucket(len(words))}",
+                 f"fmt:{response_format['type'] if response_format else 'text'}"]
+        if max_tokens:
+            extra.append(f"max:{_bucket(max_tokens)}")
+        names += extra
+        values += [1.0] * len(extra)
+        indices = np.fromiter((zlib.crc32(n.encode('utf-8')) % self.dim for n in names),
+                              dtype=np.int64, count=len(names))
+        return indices, np.asarray(values, dtype=np.float32)
+
+    def _score(self, features):
+        indices, values = features
+        return self.bias + float(self.weights[indices] @ values)
+
+    def predict(self, features, max_tokens=None):
+        """Expected completion tokens, capped at max_tokens"""
+        tokens = max(1.0, math.expm1(self._score(features)))
+        return min(tokens, max_tokens) if max_tokens else tokens
+
+    def observe(self, features, completion_tokens, truncated=False):
+        """Learn from a finished request; truncated means it hit max_tokens"""
+        indices, values = features
+        target = math.log1p(completion_tokens)
+        with self._lock:
+            score = self._score(features)
+            predicted = math.expm1(score)
+            error = abs(predicted - completion_tokens)
+            self.abs_error = error if self.abs_error is None else 0.95 * self.abs_error + 0.05 * error
+            self.observations += 1
+            if truncated and score >= target:
+                return
+            gradient = (score - target) * values
+            np.add.at(self.grad_sq, indices, gradient * gradient)
+            np.add.at(self.weights, indices,
+                      -self.learning_rate * gradient / np.sqrt(self.grad_sq[indices]))
+            self.bias -= self.learning_rate * 0.1 * (score - target)
+
+    def info(self):
+        return {
+            'observations': self.observations,
+            'mean_abs_error_tokens': round(self.abs_error, 1) if self.abs_error is not None else None,
+            'memory_bytes': self.weights.nbytes + self.grad_sq.nbytes
+        }
+
+class ServiceTime:
+    """Seconds per generated token (EWMA), to turn predicted tokens into seconds"""
+
+    def __init__(self, seconds_per_token=0.05):
+        self.seconds_per_token = seconds_per_token
+
+    def observe(self, seconds, tokens):
+        if tokens > 0:
+            self.seconds_per_token = 0.9 * self.seconds_per_token + 0.1 * seconds / tokens
+
+    def seconds(self, tokens):
+        return tokens * self.seconds_per_token
@@ -0,0 +1,248 @@
+"""Sharded request metrics with fixed-memory rolling windows
+
+Each thread is assigned a shard round-robin the first time it records, so
+concurrent Flask threads rarely touch the same lock. Each shard keeps
+lifetime totals plus a ring of time slots (request count, tokens, errors
+and a log-bucketed latency histogram per slot) covering the longest window.
+Readers merge the shards without taking any locks; a slightly stale read is
+fine for monitoring.
+"""
+import itertools
+import math
+import threading
+import time
+
+import numpy as np
+
+NUM_SHARDS = 16
+SLOT_SECONDS = 5
+WINDOWS = {'1m': 60, '5m': 300, '15m': 900}
+
+# Latency histogram: bucket i covers [MIN * GAMMA**i, MIN * GAMMA**(i+1)),
+# giving quantiles within ~10% from 1ms to ~15 minutes
+LATENCY_MIN = 0.001
+LATENCY_GAMMA = 1.2
+LATENCY_BUCKETS = int(math.ceil(math.log(900 / LATENCY_MIN, LATENCY_GAMMA))) + 1
+QUANTILES = (0.5, 0.95, 0.99)
+
+def latency_bucket(seconds):
+    """Histogram bucket index for a latency in seconds"""
+    if seconds <= LATENCY_MIN:
+        return 0
+    return min(LATENCY_BUCKETS - 1, int(math.log(seconds / LATENCY_MIN, LATENCY_GAMMA)) + 1)
+
+def bucket_value(index):
+    """Representative latency (geometric bucket midpoint) for a bucket index"""
+    if index == 0:
+        return LATENCY_MIN
+    return LATENCY_MIN * LATENCY_GAMMA ** (index - 0.5)
+
+class _Shard:
+    """Counters owned by the threads that hash to this shard"""
+
+    def __init__(self, slots):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.service_sum = 0.0
+        self.service_count = 0
+        self.in_flight = 0
+        self.wire_responses = 0
+        self.wire_bytes_in = 0
+        self.wire_bytes_body = 0
+        self.wire_bytes_out = 0
+        self.serialize_cpu = 0.0
+        self.epochs = np.full(slots, -1, dtype=np.int64)
+        self.slot_requests = np.zeros(slots, dtype=np.int64)
+        self.slot_tokens = np.zeros(slots, dtype=np.int64)
+        self.slot_errors = np.zeros(slots, dtype=np.int64)
+        self.slot_service_sum = np.zeros(slots, dtype=np.float64)
+        self.slot_service_count = np.zeros(slots, dtype=np.int64)
+        self.slot_latency = np.zeros((slots, LATENCY_BUCKETS), dtype=np.int32)
+
+    def slot(self, epoch):
+        """Ring index for epoch, clearing it if it still holds an older slot"""
+        index = epoch % len(self.epochs)
+        if self.epochs[index] != epoch:
+            self.slot_requests[index] = 0
+            self.slot_tokens[index] = 0
+            self.slot_errors[index] = 0
+            self.slot_service_sum[index] = 0.0
+            self.slot_service_count[index] = 0
+            self.slot_latency[index].fill(0)
+            self.epochs[index] = epoch
+        return index
+
+class MetricsAggregator:
+    """Request rate, token throughput and latency quantiles over rolling windows"""
+
+    def __init__(self, shards=NUM_SHARDS, slot_seconds=SLOT_SECONDS, windows=WINDOWS):
+        self.slot_seconds = slot_seconds
+        self.windows = dict(windows)
+        slots = max(self.windows.values()) // slot_seconds + 1
+        self._shards = [_Shard(slots) for _ in range(shards)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        self.started = time.time()
+
+    def _shard(self):
+        # Thread idents are aligned addresses, so ident % shards would put
+        # every thread on shard 0; hand out shards in turn instead
+        index = getattr(self._local, 'shard', None)
+        if index is None:
+            index = self._local.shard = next(self._next_shard) % len(self._shards)
+        return self._shards[index]
+
+    def record(self, latency, tokens=0, error=False, service_seconds=None):
+        """Record one finished request
+
+        service_seconds is the time spent in the backend, without queueing;
+        None for requests that never reached it (cache hits).
+        """
+        shard = self._shard()
+        epoch = int(time.time() // self.slot_seconds)
+        with shard.lock:
+            index = shard.slot(epoch)
+            if error:
+                shard.errors += 1
+                shard.slot_errors[index] += 1
+                return
+            shard.requests += 1
+            shard.tokens += tokens
+            shard.latency_sum += latency
+            shard.slot_requests[index] += 1
+            shard.slot_tokens[index] += tokens
+            shard.slot_latency[index, latency_bucket(latency)] += 1
+            if service_seconds is not None:
+                shard.service_sum += service_seconds
+                shard.service_count += 1
+                shard.slot_service_sum[index] += service_seconds
+                shard.slot_service_count[index] += 1
+
+    def record_wire(self, bytes_in, bytes_body, bytes_out, cpu_seconds):
+        """Record request/response sizes and serialization + compression CPU time"""
+        shard = self._shard()
+        with shard.lock:
+            shard.wire_responses += 1
+            shard.wire_bytes_in += bytes_in
+            shard.wire_bytes_body += bytes_body
+            shard.wire_bytes_out += bytes_out
+            shard.serialize_cpu += cpu_seconds
+
+    def request_started(self):
+        shard = self._shard()
+        with shard.lock:
+            shard.in_flight += 1
+
+    def request_finished(self):
+        # Must run on the thread that called request_started (same shard)
+        shard = self._shard()
+        with shard.lock:
+            shard.in_flight -= 1
+
+    @property
+    def in_flight(self):
+        return sum(shard.in_flight for shard in self._shards)
+
+    def totals(self):
+        """Lifetime totals merged across shards"""
+        requests = sum(s.requests for s in self._shards)
+        latency_sum = sum(s.latency_sum for s in self._shards)
+        served = sum(s.service_count for s in self._shards)
+        service_sum = sum(s.service_sum for s in self._shards)
+        return {
+            'total_requests': requests,
+            'total_tokens': sum(s.tokens for s in self._shards),
+            'total_errors': sum(s.errors for s in self._shards),
+            'average_latency_seconds': round(latency_sum / requests, 3) if requests else 0,
+            'average_service_seconds': round(service_sum / served, 3) if served else None,
+            'in_flight': self.in_flight
+        }
+
+    def wire(self):
+        """Bytes on the wire and serialization CPU, merged across shards"""
+        responses = sum(s.wire_responses for s in self._shards)
+        body = sum(s.wire_bytes_body for s in self._shards)
+        out = sum(s.wire_bytes_out for s in self._shards)
+        cpu = sum(s.serialize_cpu for s in self._shards)
+        return {
+            'responses': responses,
+            'bytes_in': sum(s.wire_bytes_in for s in self._shards),
+            'bytes_uncompressed': body,
+            'bytes_out': out,
+            'compression_ratio': round(body / out, 2) if out else None,
+            'serialize_cpu_ms_per_response': round(cpu * 1000 / responses, 3) if responses else 0.0
+        }
+
+    def window(self, seconds):
+        """Rates and latency quantiles over the last `seconds`"""
+        now = time.time()
+        current = int(now // self.slot_seconds)
+        oldest = current - seconds // self.slot_seconds
+
+        requests = tokens = errors = served = 0
+        service_sum = 0.0
+        histogram = np.zeros(LATENCY_BUCKETS, dtype=np.int64)
+        for shard in self._shards:
+            live = (shard.epochs > oldest) & (shard.epochs <= current)
+            if not live.any():
+                continue
+            requests += int(shard.slot_requests[live].sum())
+            tokens += int(shard.slot_tokens[live].sum())
+            errors += int(shard.slot_errors[live].sum())
+            served += int(shard.slot_service_count[live].sum())
+            service_sum += float(shard.slot_service_sum[live].sum())
+            histogram += shard.slot_latency[live].sum(axis=0)
+
+        elapsed = min(seconds, max(now - self.started, self.slot_seconds))
+        result = {
+            'requests': requests,
+            'errors': errors,
+            'requests_per_second': round(requests / elapsed, 3),
+            'tokens_per_second': round(tokens / elapsed, 2),
+            'avg_service_seconds': round(service_sum / served, 3) if served else None
+        }
+        result.update(self._quantiles(histogram))
+        return result
+
+    @staticmethod
+    def _quantiles(histogram):
+        total = int(histogram.sum())
+        if total == 0:
+            return {f"p{int(q * 100)}_latency_seconds": None for q in QUANTILES}
+        cumulative = np.cumsum(histogram)
+        return {
+            f"p{int(q * 100)}_latency_seconds":
+                round(bucket_value(int(np.searchsorted(cumulative, q * total))), 3)
+            for q in QUANTILES
+        }
+
+    def snapshot(self):
+        """Totals plus every rolling window, for /metrics"""
+        return {
+            **self.totals(),
+            'wire': self.wire(),
+            'windows': {name: self.window(seconds) for name, seconds in self.windows.items()}
+        }
+
+    def prometheus(self, model_name):
+        """Render the snapshot in the Prometheus text exposition format"""
+        snap = self.snapshot()
+        label = f'model="{model_name}"'
+        lines = [
+            f"llm_requests_total{{{label}}} {snap['total_requests']}",
+            f"llm_tokens_total{{{label}}} {snap['total_tokens']}",
+            f"llm_errors_total{{{label}}} {snap['total_errors']}",
+            f"llm_requests_in_flight{{{label}}} {snap['in_flight']}"
+        ]
+        for name, window in snap['windows'].items():
+            wl = f'{label},window="{name}"'
+            lines.append(f"llm_requests_per_second{{{wl}}} {window['requests_per_second']}")
+            lines.append(f"llm_tokens_per_second{{{wl}}} {window['tokens_per_second']}")
+            for q in QUANTILES:
+                value = window[f"p{int(q * 100)}_latency_seconds"]
+                if value is not None:
+                    lines.append(f'llm_latency_seconds{{{wl},quantile="{q}"}} {value}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,337 @@
+"""Model artifact fetcher with a content-addressed, node-shareable cache
+
+Layout of the cache directory (safe to share between pods via hostPath):
+
+    blobs/sha256-<digest>    verified model files, named by content hash
+    refs/<url-key>           digest of the blob downloaded from a URL
+    partial/<url-key>.part   download in progress (+ .json chunk state)
+    locks/<url-key>.lock     flock so only one process downloads a URL
+
+Large files are fetched with parallel HTTP range requests. Completed chunks
+are recorded, so an interrupted download resumes where it stopped. Servers
+without range support fall back to a single stream.
+
+Usage:
+    python src/model_fetch.py --model codellama-7b-instruct --dest models
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import config
+
+HASH_BLOCK = 8 * 1024 * 1024
+STREAM_BLOCK = 1024 * 1024
+
+class ModelFetchError(Exception):
+    """Download failed or the artifact did not match its checksum"""
+
+def url_key(url):
+    """Short stable name for a URL inside the cache"""
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+def published_sha256(url, session=None):
+    """sha256 the server publishes for url, or None
+
+    Hugging Face answers a HEAD on a resolve/ URL with the LFS object's
+    sha256 in X-Linked-Etag (before redirecting to its CDN); other servers
+    may use a sha256 as the ETag. Anything else (or no network) gives None.
+    """
+    try:
+        response = (session or requests).head(url, allow_redirects=False, timeout=30)
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️  Could not look up the published checksum of {url}: {e}")
+        return None
+    for header in ('X-Linked-Etag', 'ETag'):
+        value = response.headers.get(header, '').strip()
+        value = value[2:] if value.startswith('W/') else value
+        value = value.strip('"').lower()
+        if re.fullmatch(r'[0-9a-f]{64}', value):
+            return value
+    return None
+
+def discard(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ModelCache:
+    """Content-addressed store of model files"""
+
+    def __init__(self, root):
+        self.root = root
+        for sub in ('blobs', 'refs', 'partial', 'locks'):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', f"sha256-{digest}")
+
+    def lookup(self, url, sha256=None):
+        """Path of a cached blob for this artifact, or None"""
+        if sha256 and os.path.exists(self.blob_path(sha256)):
+            return self.blob_path(sha256)
+        ref = os.path.join(self.root, 'refs', url_key(url))
+        if os.path.exists(ref):
+            with open(ref) as f:
+                digest = f.read().strip()
+            if (not sha256 or digest == sha256) and os.path.exists(self.blob_path(digest)):
+                return self.blob_path(digest)
+        return None
+
+    def commit(self, url, part_path, digest):
+        """Move a finished download into blobs/ and point the URL ref at it"""
+        blob = self.blob_path(digest)
+        os.replace(part_path, blob)
+        discard(part_path + '.json')
+        os.chmod(blob, 0o444)
+        ref = os.path.join(self.root, 'refs', url_key(url))
+        with open(ref + '.tmp', 'w') as f:
+            f.write(digest)
+        os.replace(ref + '.tmp', ref)
+        return blob
+
+    def lock(self, url):
+        """Exclusive per-URL lock shared by every process using this cache"""
+        handle = open(os.path.join(self.root, 'locks', url_key(url) + '.lock'), 'w')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+class RangedDownloader:
+    """Parallel, resumable download of one URL into a .part file"""
+
+    def __init__(self, url, part_path, workers=8, chunk_size=64 * 1024 * 1024, session=None):
+        self.url = url
+        self.part_path = part_path
+        self.state_path = part_path + '.json'
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.session = session or requests.Session()
+        self._state_lock = threading.Lock()
+        self._downloaded = 0
+
+    def probe(self):
+        """Return (size, supports_ranges, validator) from a HEAD request"""
+        response = self.session.head(self.url, allow_redirects=True, timeout=30)
+        if response.status_code != 200:
+            raise ModelFetchError(f"HEAD {self.url} returned HTTP {response.status_code}")
+        size = int(response.headers.get('Content-Length', 0)) or None
+        ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        return size, ranges and size is not None, validator
+
+    def _read_state(self):
+        """Saved state of a previous attempt, or None"""
+        if not (os.path.exists(self.state_path) and os.path.exists(self.part_path)):
+            return None
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _load_state(self, size, validator):
+        """Resume state if it matches the remote file, otherwise start over"""
+        state = self._read_state()
+        if (state is not None and state.get('size') == size and state.get('validator') == validator
+                and state.get('chunk_size') == self.chunk_size):
+            return state
+        with open(self.part_path, 'wb') as f:
+            f.truncate(size)
+        return {'size': size, 'validator': validator, 'chunk_size': self.chunk_size, 'done': []}
+
+    def _save_state(self, state):
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def _fetch_chunk(self, index, size, state):
+        start = index * self.chunk_size
+        end = min(size, start + self.chunk_size) - 1
+        response = self.session.get(self.url, headers={'Range': f"bytes={start}-{end}"},
+                                    stream=True, timeout=(10, 60))
+        with response:
+            if response.status_code != 206:
+                raise ModelFetchError(f"Range request returned HTTP {response.status_code}")
+            written = 0
+            with open(self.part_path, 'r+b') as f:
+                f.seek(start)
+                for block in response.iter_content(STREAM_BLOCK):
+                    f.write(block)
+                    written += len(block)
+                    with self._state_lock:
+                        self._downloaded += len(block)
+        if written != end - start + 1:
+            raise ModelFetchError(f"Chunk {index} truncated: {written} of {end - start + 1} bytes")
+        with self._state_lock:
+            state['done'].append(index)
+            self._save_state(state)
+
+    def _download_ranged(self, size, validator):
+        state = self._load_state(size, validator)
+        n_chunks = (size + self.chunk_size - 1) // self.chunk_size
+        pending = [i for i in range(n_chunks) if i not in set(state['done'])]
+        self._downloaded = (n_chunks - len(pending)) * self.chunk_size
+        if len(pending) < n_chunks:
+            print(f"   Resuming: {n_chunks - len(pending)}/{n_chunks} chunks already on disk")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._fetch_chunk, i, size, state) for i in pending]
+            last_report = 0
+            while not all(f.done() for f in futures):
+                time.sleep(0.5)
+                if time.time() - last_report >= 10:
+                    last_report = time.time()
+                    print(f"   {min(self._downloaded, size) / size * 100:5.1f}% "
+                          f"of {size / 1024 ** 3:.2f}GB")
+            for future in futures:
+                future.result()
+
+    def _download_stream(self, size, validator):
+        """Single-connection download, resuming with a Range header when possible
+
+        Only a .part file saved for the same size and validator is resumed;
+        leftovers of a ranged attempt or of a changed remote file start over.
+        """
+        state = {'size': size, 'validator': validator, 'stream': True}
+        offset = 0
+        if validator is not None and self._read_state() == state:
+            offset = os.path.getsize(self.part_path)
+        if size is not None and offset > size:
+            offset = 0
+        self._save_state(state)
+        if offset and offset == size:
+            return  # Finished before the process stopped short of committing it
+
+        # If-Range makes the server send the whole file if it changed meanwhile
+        headers = {'Range': f"bytes={offset}-", 'If-Range': validator} if offset else {}
+        response = self.session.get(self.url, headers=headers, stream=True, timeout=(10, 60))
+        with response:
+            if (response.status_code == 416 and offset
+                    and response.headers.get('Content-Range') == f"bytes */{offset}"):
+                return  # Already complete; the size was unknown before
+            if response.status_code == 200:
+                offset = 0  # server ignored the range; start over
+            elif response.status_code != 206:
+                raise ModelFetchError(f"GET {self.url} returned HTTP {response.status_code}")
+            with open(self.part_path, 'r+b' if offset else 'wb') as f:
+                f.seek(offset)
+                for block in response.iter_content(STREAM_BLOCK):
+                    f.write(block)
+
+    def download(self):
+        """Fill part_path; its state file is kept until the caller commits it
+
+        A process that stops after the download but before the commit finds
+        the file complete on the next run and sends no further requests.
+        """
+        size, ranges, validator = self.probe()
+        if ranges and size > self.chunk_size:
+            print(f"   Parallel download: {self.workers} workers, "
+                  f"{self.chunk_size // (1024 * 1024)}MB chunks")
+            self._download_ranged(size, validator)
+        else:
+            self._download_stream(size, validator)
+        if size is not None and os.path.getsize(self.part_path) != size:
+            raise ModelFetchError(f"Downloaded size {os.path.getsize(self.part_path)} != {size}")
+
+def link_into(blob, dest_path):
+    """Expose a cached blob at dest_path (symlink, falling back to a copy)"""
+    if os.path.islink(dest_path) and os.path.realpath(dest_path) == os.path.realpath(blob):
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    tmp = dest_path + '.tmp'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.symlink(os.path.abspath(blob), tmp)
+    except OSError:
+        shutil.copyfile(blob, tmp)
+    os.replace(tmp, dest_path)
+
+def fetch(url, dest_path, cache_dir=None, sha256=None, workers=None, chunk_mb=None):
+    """Make the artifact at url available at dest_path, downloading only on a cache miss
+
+    Without a pinned sha256 the checksum the server publishes is used, so the
+    download is still verified and the cache is keyed by content; only when
+    none is published (or the server is unreachable) does the URL ref decide.
+    Returns the path of the blob in the cache.
+    """
+    cache = ModelCache(cache_dir or config.MODEL_CACHE_DIR)
+    sha256 = sha256 or published_sha256(url)
+
+    blob = cache.lookup(url, sha256)
+    if blob is None:
+        with cache.lock(url):
+            # Another pod on this node may have finished while we waited
+            blob = cache.lookup(url, sha256)
+            if blob is None:
+                print(f"⬇️  Downloading {url}")
+                start = time.time()
+                part_path = os.path.join(cache.root, 'partial', url_key(url) + '.part')
+                RangedDownloader(
+                    url, part_path,
+                    workers=workers or config.MODEL_FETCH_WORKERS,
+                    chunk_size=(chunk_mb or config.MODEL_FETCH_CHUNK_MB) * 1024 * 1024
+                ).download()
+
+                digest = sha256_file(part_path)
+                if sha256 and digest != sha256:
+                    discard(part_path, part_path + '.json')
+                    raise ModelFetchError(f"Checksum mismatch: expected {sha256}, got {digest}")
+                blob = cache.commit(url, part_path, digest)
+                verified = 'verified' if sha256 else 'not verified: no checksum published'
+                print(f"✅ Downloaded in {time.time() - start:.1f}s (sha256 {digest[:12]}, {verified})")
+    else:
+        print(f"✅ Model found in cache: {blob}")
+
+    link_into(blob, dest_path)
+    return blob
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch a model into the shared model cache')
+    parser.add_argument('--model', choices=sorted(config.MODEL_CONFIGS),
+                       help='Model key from config.MODEL_CONFIGS')
+    parser.add_argument('--url', help='Download URL (instead of --model)')
+    parser.add_argument('--filename', help='File name under --dest (with --url)')
+    parser.add_argument('--sha256', help='Expected checksum (overrides the config)')
+    parser.add_argument('--dest', default='models', help='Directory to link the model into')
+    parser.add_argument('--cache-dir', default=config.MODEL_CACHE_DIR,
+                       help=f'Cache directory (default: {config.MODEL_CACHE_DIR})')
+    parser.add_argument('--workers', type=int, default=config.MODEL_FETCH_WORKERS,
+                       help='Parallel range requests')
+    parser.add_argument('--chunk-mb', type=int, default=config.MODEL_FETCH_CHUNK_MB,
+                       help='Range request size in MB')
+    args = parser.parse_args()
+
+    if args.model:
+        model = config.MODEL_CONFIGS[args.model]
+        url, filename, sha256 = model['url'], model['filename'], model.get('sha256')
+        sha256 = config.MODEL_SHA256 or sha256
+    elif args.url and args.filename:
+        url, filename, sha256 = args.url, args.filename, None
+    else:
+        parser.error('either --model or --url with --filename is required')
+
+    try:
+        fetch(url, os.path.join(args.dest, filename), cache_dir=args.cache_dir,
+              sha256=args.sha256 or sha256, workers=args.workers, chunk_mb=args.chunk_mb)
+    except (ModelFetchError, requests.exceptions.RequestException) as e:
+        print(f"❌ Model fetch failed: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Slot-limited admission queue: shortest predicted job first, with aging
+
+Requests wait here for one of the backend's slots instead of queueing
+blindly inside the backend. With a cost (predicted seconds) per request, the
+next free slot goes to the job with the smallest cost minus `aging` x seconds
+waited, so short answers overtake long ones but nothing starves. Without
+costs the queue is FIFO. Costs also give a wait estimate for new requests.
+"""
+import time
+
+from dispatcher import SlotQueue
+
+class AdmissionScheduler:
+    """Admit at most `slots` jobs at once, shortest predicted first"""
+
+    def __init__(self, slots=1, aging=0.1, poll_interval=0.05):
+        self.aging = aging
+        self._queue = SlotQueue(slots, choose=self._next, poll_interval=poll_interval)
+        self.slots = self._queue.slots
+
+    def acquire(self, cost=None, limits=None):
+        """Wait for a slot; returns the job to pass to release()
+
+        Honours limits while queued, like UpstreamDispatcher.
+        """
+        return self._queue.acquire(limits, cost=cost)
+
+    def release(self, job):
+        self._queue.release(job)
+
+    def _next(self, waiting):
+        """Waiter to admit next; runs under the queue's lock"""
+        if any(job.cost is None for job in waiting):
+            return waiting[0]
+        now = time.time()
+        return min(waiting, key=lambda job: job.cost - self.aging * (now - job.arrived))
+
+    def estimated_wait(self, cost=None):
+        """Predicted seconds until a new job of this cost (or any job) gets a slot
+
+        None when queued or running jobs have no cost to go on.
+        """
+        running, waiting = self._queue.snapshot()
+        if len(running) < self.slots and not waiting:
+            return 0.0
+        if any(job.cost is None for job in running + waiting):
+            return None
+        now = time.time()
+        remaining = sum(max(0.0, job.cost - (now - job.started)) for job in running)
+        ahead = sum(job.cost for job in waiting if cost is None or job.cost <= cost)
+        return (remaining + ahead) / self.slots
+
+    @property
+    def queue_depth(self):
+        return self._queue.queue_depth
+
+    def info(self):
+        """Admission queue metrics for /metrics"""
+        return self._queue.info()
@@ -0,0 +1,266 @@
+"""Semantic near-duplicate response cache
+
+Prompts are embedded into unit vectors and stored in a NumPy matrix that
+grows by doubling. A lookup is one matrix-vector product; the best match is
+served if its cosine similarity clears the threshold and it was generated
+with the same parameters. Entries are evicted least-recently-used once the
+memory budget (vectors + cached responses) is exceeded.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+# Words that rarely change what code the user wants. Verbs such as "write",
+# "use" or "make" and negations are deliberately not here: they do.
+STOPWORDS = frozenset("""a an the to of for in on at by with and or that which this it is are be
+can could would please give me show how i you your my""".split())
+NEGATIONS = frozenset("not no without never except exclude excluding".split())
+
+class HashingEmbedder:
+    """Dependency-free embedder: hashed content words, word bigrams and character trigrams
+
+    Stopwords are dropped and simple suffixes stripped, so rephrasings such as
+    "write a python function to sort a list" and "Write a Python function
+    that sorts a list." match, while "... to reverse a list" does not.
+    Bigrams of neighbouring content words keep word order ("celsius to
+    fahrenheit" is not "fahrenheit to celsius"), and words after a negation
+    are marked as negated up to the end of the clause ("is not prime").
+    """
+
+    name = 'hashing'
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _words(self, text):
+        """Content words in order, stemmed, with negated words prefixed by '!'"""
+        negated = False
+        for token in re.findall(r"[a-z0-9_]+|[.,;:!?]", text.lower()):
+            if not token[0].isalnum() and token[0] != '_':
+                negated = False
+                continue
+            if token in NEGATIONS or token.endswith("n't"):
+                negated = True
+                yield token
+                continue
+            if token in STOPWORDS:
+                continue
+            for suffix in ('ing', 'es', 's'):
+                if len(token) > 4 and token.endswith(suffix):
+                    token = token[:-len(suffix)]
+                    break
+            yield '!' + token if negated else token
+
+    def _features(self, text):
+        previous = None
+        for word in self._words(text):
+            yield 'w:' + word, 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                yield 'c:' + padded[i:i + 3], 0.25
+            if previous is not None:
+                yield f"b:{previous}_{word}", 0.75
+            previous = word
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            vector[h % self.dim] += weight if (h >> 16) & 1 else -weight
+        return vector
+
+class ModelEmbedder:
+    """Embeds with a model: the loaded backend's embed() or a GGUF embedding model"""
+
+    def __init__(self, backend=None, model_path=None):
+        if model_path:
+            from llama_cpp import Llama
+            self._model = Llama(model_path=model_path, embedding=True, verbose=False)
+            self._embed = self._model.embed
+            self.name = f"gguf:{model_path.rsplit('/', 1)[-1]}"
+        elif backend is not None and backend.capabilities().get('embed'):
+            self._embed = backend.embed
+            self.name = 'backend'
+        else:
+            raise ValueError("Backend has no embed(); set SEMANTIC_CACHE_EMBEDDER to a GGUF path")
+
+    def embed(self, text):
+        vector = np.asarray(self._embed(text), dtype=np.float32)
+        # Some models return per-token embeddings; mean-pool them
+        return vector.mean(axis=0) if vector.ndim == 2 else vector
+
+def make_embedder(spec, backend=None):
+    """Build the embedder named by SEMANTIC_CACHE_EMBEDDER"""
+    if spec == 'hashing':
+        return HashingEmbedder()
+    if spec == 'backend':
+        return ModelEmbedder(backend=backend)
+    return ModelEmbedder(model_path=spec)
+
+def params_signature(**params):
+    """Hash of the generation parameters a cached answer is only valid for"""
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return int.from_bytes(hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest(),
+                          'little', signed=True)
+
+class SemanticCache:
+    """Bounded near-duplicate cache over prompt embeddings"""
+
+    # Upper edges of the similarity buckets reported for hits
+    QUALITY_BUCKETS = (0.92, 0.95, 0.98, 0.999, 1.01)
+
+    def __init__(self, embedder, threshold=0.9, max_bytes=64 * 1024 * 1024):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self._dim = None
+        self._max_rows = 0
+        self._vectors = None
+        self._signatures = None
+        self._last_used = None
+        self._entries = []  # cached response dicts, aligned with matrix rows
+        self._entry_bytes = []
+        self._size = 0
+        self._bytes = 0
+
+        self.stats = {
+            'lookups': 0,
+            'hits': 0,
+            'misses': 0,
+            'inserts': 0,
+            'evictions': 0,
+            'hit_similarity_sum': 0.0,
+            'hit_similarity_min': None,
+            'hit_buckets': [0] * len(self.QUALITY_BUCKETS)
+        }
+
+    def _embed(self, prompt):
+        vector = np.asarray(self.embedder.embed(prompt), dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else None
+
+    def _allocate(self, dim):
+        """Start with a small matrix; _grow() doubles it as entries arrive"""
+        self._dim = dim
+        # Rows whose vectors alone would fill the budget; never grow past it
+        self._max_rows = max(16, self.max_bytes // (dim * 4 + 64))
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._signatures = np.zeros(0, dtype=np.int64)
+        self._last_used = np.zeros(0, dtype=np.float64)
+        self._grow()
+
+    def _grow(self):
+        """Double the row capacity (up to _max_rows), keeping the live rows"""
+        capacity = min(self._max_rows, max(16, 2 * len(self._vectors)))
+        vectors = np.zeros((capacity, self._dim), dtype=np.float32)
+        signatures = np.zeros(capacity, dtype=np.int64)
+        last_used = np.zeros(capacity, dtype=np.float64)
+        vectors[:self._size] = self._vectors[:self._size]
+        signatures[:self._size] = self._signatures[:self._size]
+        last_used[:self._size] = self._last_used[:self._size]
+        self._vectors, self._signatures, self._last_used = vectors, signatures, last_used
+
+    def lookup(self, prompt, signature):
+        """Return (entry, similarity) for the best near-duplicate, or (None, best)"""
+        query = self._embed(prompt)
+        with self._lock:
+            self.stats['lookups'] += 1
+            if query is None or self._size == 0 or query.shape[0] != self._dim:
+                self.stats['misses'] += 1
+                return None, 0.0
+
+            sims = self._vectors[:self._size] @ query
+            sims[self._signatures[:self._size] != signature] = -1.0
+            best = int(np.argmax(sims))
+            similarity = float(sims[best])
+            if similarity < self.threshold:
+                self.stats['misses'] += 1
+                return None, similarity
+
+            self._last_used[best] = time.time()
+            self.stats['hits'] += 1
+            self.stats['hit_similarity_sum'] += similarity
+            low = self.stats['hit_similarity_min']
+            self.stats['hit_similarity_min'] = similarity if low is None else min(low, similarity)
+            for i, edge in enumerate(self.QUALITY_BUCKETS):
+                if similarity < edge:
+                    self.stats['hit_buckets'][i] += 1
+                    break
+            return self._entries[best], similarity
+
+    def insert(self, prompt, signature, entry):
+        """Cache a response for prompt, evicting LRU entries to stay in budget"""
+        vector = self._embed(prompt)
+        if vector is None:
+            return
+        entry_bytes = vector.nbytes + len(json.dumps(entry).encode('utf-8'))
+        if entry_bytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if self._vectors is None:
+                self._allocate(vector.shape[0])
+            if vector.shape[0] != self._dim:
+                return
+
+            if self._size >= len(self._vectors) and len(self._vectors) < self._max_rows:
+                self._grow()
+            while self._size and (self._size >= len(self._vectors)
+                                  or self._bytes + entry_bytes > self.max_bytes):
+                self._evict_lru()
+
+            row = self._size
+            self._vectors[row] = vector
+            self._signatures[row] = signature
+            self._last_used[row] = time.time()
+            self._entries.append(entry)
+            self._entry_bytes.append(entry_bytes)
+            self._size += 1
+            self._bytes += entry_bytes
+            self.stats['inserts'] += 1
+
+    def _evict_lru(self):
+        """Drop the least recently used row by moving the last row into its place"""
+        victim = int(np.argmin(self._last_used[:self._size]))
+        last = self._size - 1
+        self._bytes -= self._entry_bytes[victim]
+        if victim != last:
+            self._vectors[victim] = self._vectors[last]
+            self._signatures[victim] = self._signatures[last]
+            self._last_used[victim] = self._last_used[last]
+            self._entries[victim] = self._entries[last]
+            self._entry_bytes[victim] = self._entry_bytes[last]
+        self._entries.pop()
+        self._entry_bytes.pop()
+        self._size -= 1
+        self.stats['evictions'] += 1
+
+    def info(self):
+        """Cache size and hit-quality statistics for /metrics"""
+        with self._lock:
+            stats = dict(self.stats)
+            hits = stats.pop('hit_similarity_sum')
+            buckets = stats.pop('hit_buckets')
+            if stats['hit_similarity_min'] is not None:
+                stats['hit_similarity_min'] = round(stats['hit_similarity_min'], 4)
+            return {
+                **stats,
+                'entries': self._size,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'threshold': self.threshold,
+                'embedder': self.embedder.name,
+                'hit_rate': round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0,
+                'hit_similarity_avg': round(hits / stats['hits'], 4) if stats['hits'] else None,
+                'hit_similarity_histogram': {
+                    f"<{edge:g}" if edge <= 1 else "exact": count
+                    for edge, count in zip(self.QUALITY_BUCKETS, buckets)
+                }
+            }
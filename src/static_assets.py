@@ -0,0 +1,82 @@
+"""In-memory static asset store with ETag/304 and precompressed variants
+
+Loads the built frontend (scripts/build_frontend.py) once at startup. Hashed
+assets are served with a one-year immutable Cache-Control; index.html is
+revalidated with its ETag so new deploys show up immediately. Precompressed
+.zst/.gz files are picked according to Accept-Encoding, so serving a page
+costs no compression CPU. Framework-agnostic: used by the Flask app and by
+src/static_server.py.
+"""
+import hashlib
+import mimetypes
+import os
+
+from wire import choose_encoding
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+ENCODINGS = (('zstd', '.zst'), ('gzip', '.gz'))
+
+class StaticAssets:
+    """Built frontend files held in memory, keyed by URL path"""
+
+    def __init__(self, dist_dir, fallback_dir=None):
+        self.files = {}
+        root = dist_dir if os.path.isdir(dist_dir) else fallback_dir
+        self.built = root == dist_dir
+        if root is None or not os.path.isdir(root):
+            return
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if not os.path.isfile(path) or name.endswith(('.gz', '.zst')) or name == 'manifest.json':
+                continue
+            self.files[name] = self._load(root, name)
+
+    @staticmethod
+    def _load(root, name):
+        with open(os.path.join(root, name), 'rb') as f:
+            body = f.read()
+        variants = {}
+        for coding, suffix in ENCODINGS:
+            compressed = os.path.join(root, name + suffix)
+            if os.path.exists(compressed):
+                with open(compressed, 'rb') as f:
+                    variants[coding] = f.read()
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype == 'application/javascript':
+            mimetype += '; charset=utf-8'
+        return {
+            'body': body,
+            'variants': variants,
+            'mimetype': mimetype,
+            'etag': '"' + hashlib.sha256(body).hexdigest()[:20] + '"',
+            # Build output names every asset except index.html by content hash
+            'cache_control': REVALIDATE if name.endswith('.html') else IMMUTABLE
+        }
+
+    def lookup(self, name, accept_encoding='', if_none_match=''):
+        """Return (status, headers, body) for a request, or None if unknown
+
+        status is 200 or 304; headers is a list of (name, value) pairs.
+        """
+        asset = self.files.get(name)
+        if asset is None:
+            return None
+
+        headers = [
+            ('ETag', asset['etag']),
+            ('Cache-Control', asset['cache_control']),
+            ('Vary', 'Accept-Encoding')
+        ]
+        if asset['etag'] in [t.strip().removeprefix('W/') for t in (if_none_match or '').split(',')]:
+            return 304, headers, b''
+
+        # Highest-q precompressed variant the client accepts, smallest first on ties
+        by_size = sorted(asset['variants'], key=lambda c: len(asset['variants'][c]))
+        coding = choose_encoding(accept_encoding, by_size)
+        body = asset['body']
+        if coding is not None:
+            body = asset['variants'][coding]
+            headers.append(('Content-Encoding', coding))
+        headers += [('Content-Type', asset['mimetype']), ('Content-Length', str(len(body)))]
+        return 200, headers, body
@@ -0,0 +1,56 @@
+"""Lightweight static server for the frontend, separate from the inference API
+
+Serves frontend/dist (or the raw frontend/ when not built) from memory on
+its own port, so page loads never occupy an inference worker. Run alongside
+the API with SERVE_FRONTEND=false:
+
+    python src/static_server.py --port 8081
+"""
+import argparse
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+from static_assets import StaticAssets
+
+class StaticHandler(BaseHTTPRequestHandler):
+    assets = None
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        name = self.path.split('?', 1)[0].lstrip('/') or 'index.html'
+        result = self.assets.lookup(name, self.headers.get('Accept-Encoding'),
+                                    self.headers.get('If-None-Match'))
+        if result is None:
+            self.send_error(404)
+            return
+        status, headers, body = result
+        self.send_response(status)
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the built frontend')
+    parser.add_argument('--host', default=config.API_HOST)
+    parser.add_argument('--port', type=int, default=config.STATIC_PORT)
+    args = parser.parse_args()
+
+    frontend = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend')
+    StaticHandler.assets = StaticAssets(os.path.join(frontend, 'dist'), fallback_dir=frontend)
+    print(f"✅ Serving {len(StaticHandler.assets.files)} frontend file(s) "
+          f"({'built' if StaticHandler.assets.built else 'unbuilt'}) on {args.host}:{args.port}")
+    ThreadingHTTPServer((args.host, args.port), StaticHandler).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Structured output support: response_format parsing, grammar cache, early stop"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import config
+
+RESPONSE_FORMAT_TYPES = ('json_object', 'json_schema', 'grammar')
+
+# Compiled grammars keyed by the sha256 of the canonical response_format
+_grammar_cache = OrderedDict()
+_grammar_lock = threading.Lock()
+_grammar_stats = {'hits': 0, 'misses': 0}
+
+def parse_response_format(response_format):
+    """Validate a request-level response_format and return it normalized
+
+    Accepted shapes:
+        {"type": "json_object"}
+        {"type": "json_schema", "schema": {...}}
+        {"type": "grammar", "grammar": "<GBNF source>"}
+
+    Raises ValueError with a client-facing message for anything else.
+    """
+    if response_format is None:
+        return None
+    if not isinstance(response_format, dict):
+        raise ValueError("response_format must be an object")
+
+    kind = response_format.get('type')
+    if kind not in RESPONSE_FORMAT_TYPES:
+        raise ValueError(f"response_format.type must be one of {', '.join(RESPONSE_FORMAT_TYPES)}")
+
+    if kind == 'json_object':
+        return {'type': 'json_object'}
+
+    if kind == 'json_schema':
+        # Also accept the OpenAI shape {"json_schema": {"schema": {...}}}
+        schema = response_format.get('schema')
+        if schema is None and isinstance(response_format.get('json_schema'), dict):
+            schema = response_format['json_schema'].get('schema')
+        if not isinstance(schema, dict):
+            raise ValueError("response_format.schema must be a JSON schema object")
+        return {'type': 'json_schema', 'schema': schema}
+
+    grammar = response_format.get('grammar')
+    if not isinstance(grammar, str) or not grammar.strip():
+        raise ValueError("response_format.grammar must be a non-empty GBNF string")
+    return {'type': 'grammar', 'grammar': grammar}
+
+def is_json_format(response_format):
+    """True if the format produces a single JSON value"""
+    return response_format is not None and response_format['type'] in ('json_object', 'json_schema')
+
+def format_key(response_format):
+    """Stable hash of a normalized response_format"""
+    canonical = json.dumps(response_format, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def get_grammar(response_format):
+    """Return a compiled LlamaGrammar for the format, compiling at most once per schema"""
+    key = format_key(response_format)
+    with _grammar_lock:
+        grammar = _grammar_cache.get(key)
+        if grammar is not None:
+            _grammar_cache.move_to_end(key)
+            _grammar_stats['hits'] += 1
+            return grammar
+        _grammar_stats['misses'] += 1
+
+    # Compile outside the lock; a concurrent miss on the same key just compiles twice
+    from llama_cpp import LlamaGrammar
+    from llama_cpp.llama_grammar import JSON_GBNF
+
+    kind = response_format['type']
+    if kind == 'json_object':
+        grammar = LlamaGrammar.from_string(JSON_GBNF, verbose=False)
+    elif kind == 'json_schema':
+        grammar = LlamaGrammar.from_json_schema(json.dumps(response_format['schema']), verbose=False)
+    else:
+        grammar = LlamaGrammar.from_string(response_format['grammar'], verbose=False)
+
+    with _grammar_lock:
+        _grammar_cache[key] = grammar
+        _grammar_cache.move_to_end(key)
+        while len(_grammar_cache) > config.GRAMMAR_CACHE_SIZE:
+            _grammar_cache.popitem(last=False)
+    return grammar
+
+def grammar_cache_info():
+    """Grammar cache statistics for /metrics"""
+    with _grammar_lock:
+        return {
+            'size': len(_grammar_cache),
+            'capacity': config.GRAMMAR_CACHE_SIZE,
+            'hits': _grammar_stats['hits'],
+            'misses': _grammar_stats['misses']
+        }
+
+class JsonCompletionTracker:
+    """Incrementally scans generated text and detects when a JSON value is complete
+
+    Only objects and arrays are tracked: the value is complete when the
+    bracket depth returns to zero outside of a string. `end` is the offset
+    just past the closing bracket.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.end = None
+
+    @property
+    def done(self):
+        return self.end is not None
+
+    def feed(self, chunk):
+        """Consume more generated text; returns True once the value is complete"""
+        if self.done:
+            return True
+
+        offset = len(self.text)
+        self.text += chunk
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                self.depth += 1
+                self.started = True
+            elif ch in '}]':
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    self.end = offset + i + 1
+                    return True
+        return False
+
+def trim_to_structure(text):
+    """Cut text right after the first complete JSON object/array, if any"""
+    tracker = JsonCompletionTracker()
+    tracker.feed(text)
+    return text[:tracker.end] if tracker.done else text
+
+class JsonStopCriteria:
+    """llama-cpp stopping criterion that ends generation once the JSON value closes
+
+    The grammar alone lets the model keep emitting trailing whitespace until
+    max_tokens; this stops on the closing bracket instead.
+    """
+
+    def __init__(self, model, n_prompt_tokens):
+        self.model = model
+        self.n_prompt_tokens = n_prompt_tokens
+        self.n_seen = n_prompt_tokens
+        self.tracker = JsonCompletionTracker()
+
+    def __call__(self, input_ids, logits):
+        if len(input_ids) <= self.n_seen:
+            return self.tracker.done
+        new_tokens = input_ids[self.n_seen:]
+        self.n_seen = len(input_ids)
+        chunk = self.model.detokenize(list(new_tokens)).decode('utf-8', errors='ignore')
+        return self.tracker.feed(chunk)
@@ -0,0 +1,126 @@
+"""Wire formats for the API: content negotiation, compression and msgpack
+
+Responses are JSON unless the client sends `Accept: application/msgpack`.
+Bodies above COMPRESS_MIN_BYTES are compressed with zstd or gzip according
+to Accept-Encoding. Streaming bodies use an incremental compressor that is
+flushed after every item, so clients can decode results as they arrive.
+"""
+import gzip
+import json
+import zlib
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+try:
+    import msgpack
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+import config
+
+JSON_MIMETYPE = 'application/json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+def _accepted(header):
+    """Parse an Accept/Accept-Encoding header into {value: q}"""
+    accepted = {}
+    for part in (header or '').split(','):
+        value, _, params = part.strip().partition(';')
+        if not value:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, number = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        accepted[value.strip().lower()] = q
+    return accepted
+
+def choose_encoding(accept_encoding, available=None):
+    """Best content-coding the client accepts, or None for identity
+
+    available lists the codings on offer in order of preference (default:
+    the ones this process can compress with); ties in q go to the earlier one.
+    """
+    accepted = _accepted(accept_encoding)
+    candidates = list(available) if available is not None else (['zstd'] if HAS_ZSTD else []) + ['gzip']
+    if not candidates:
+        return None
+    scored = [(accepted.get(c, accepted.get('*', 0.0)), -i, c) for i, c in enumerate(candidates)]
+    q, _, coding = max(scored)
+    return coding if q > 0 else None
+
+def wants_msgpack(accept):
+    """True if the client prefers msgpack and it is available"""
+    if not HAS_MSGPACK:
+        return False
+    accepted = _accepted(accept)
+    return any(accepted.get(m, 0.0) > 0 for m in MSGPACK_MIMETYPES)
+
+def is_msgpack(content_type):
+    return (content_type or '').split(';')[0].strip().lower() in MSGPACK_MIMETYPES
+
+def decode_request(request):
+    """Request body as a dict, from JSON or msgpack; None if missing/invalid"""
+    if is_msgpack(request.content_type):
+        if not HAS_MSGPACK:
+            raise ValueError("msgpack is not installed on this server")
+        try:
+            return msgpack.unpackb(request.get_data(), raw=False)
+        except (ValueError, msgpack.UnpackException):
+            return None
+    return request.get_json(silent=True)
+
+def encode(payload, use_msgpack):
+    """Serialize payload; returns (bytes, mimetype)"""
+    if use_msgpack:
+        return msgpack.packb(payload, use_bin_type=True), MSGPACK_MIMETYPES[0]
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8'), JSON_MIMETYPE
+
+def compress(body, coding):
+    """One-shot compression of a complete body"""
+    if coding == 'zstd':
+        return zstandard.ZstdCompressor(level=config.ZSTD_LEVEL).compress(body)
+    if coding == 'gzip':
+        return gzip.compress(body, compresslevel=config.GZIP_LEVEL)
+    return body
+
+class StreamCompressor:
+    """Incremental compressor for streamed bodies, flushed per item"""
+
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == 'zstd':
+            self._obj = zstandard.ZstdCompressor(level=config.ZSTD_LEVEL).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        elif coding == 'gzip':
+            self._obj = zlib.compressobj(config.GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+        else:
+            self._obj = None
+
+    def write(self, data):
+        """Compress data and flush it so the client can decode it right away"""
+        if self._obj is None:
+            return data
+        return self._obj.compress(data) + self._obj.flush(self._flush_mode)
+
+    def close(self):
+        if self._obj is None:
+            return b''
+        return self._obj.flush()
+
+def encode_stream_item(payload, use_msgpack):
+    """One item of a streamed body: NDJSON line or a bare msgpack object"""
+    if use_msgpack:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8') + b'\n'
@@ -0,0 +1,487 @@
+"""Out-of-process backend worker with automatic restart and request failover
+
+WorkerBackend runs a real backend in a child process (this file run as a
+script) and talks to it over a socketpair using multiprocessing's pickled
+message framing. A supervisor thread in the API process restarts the child
+when it exits, stops sending heartbeats, or makes no progress on a request
+for WORKER_REQUEST_TIMEOUT seconds. Requests that were in flight on a dead
+worker are resubmitted to its replacement (up to WORKER_MAX_RETRIES times),
+so a crashed or hung model costs a restart, not the HTTP front end.
+
+Messages, parent -> child:
+    ('call', id, op, args, kwargs, limits)    run a Backend method
+    ('cancel', id)                            the client went away
+child -> parent:
+    ('ready', info) or ('failed', message)    once the backend is loaded
+    ('heartbeat',)                            every HEARTBEAT_INTERVAL seconds
+    ('progress', id)                          the backend checked its limits
+                                              (between tokens; at most once per
+                                              HEARTBEAT_INTERVAL per request)
+    ('result', id, value), ('chunk', id, chunk), ('done', id)
+    ('error', id, exception name, message, status code)
+"""
+import argparse
+import atexit
+import itertools
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+import config
+from backends import BACKENDS, Backend, load_backend
+from dispatcher import QueueTimeout
+from generation import (FirstTokenTimeout, GenerationAborted, GenerationCancelled,
+                        GenerationLimits)
+
+HEARTBEAT_INTERVAL = 1.0
+RESTART_BACKOFF_MAX = 30
+# Backend methods the child will run on the API process's behalf
+OPS = ('generate', 'stream', 'tokenize', 'health', 'capabilities', 'upstream_info', 'embed')
+
+class WorkerUnavailable(GenerationAborted):
+    """No healthy worker could finish the request"""
+    status_code = 503
+
+# Exceptions re-raised in the API process with their original type
+_REMOTE_ERRORS = {cls.__name__: cls for cls in (
+    GenerationAborted, FirstTokenTimeout, GenerationCancelled, QueueTimeout,
+    WorkerUnavailable, ValueError
+)}
+
+def _limits_spec(limits):
+    """The picklable part of GenerationLimits (absolute deadlines)"""
+    if limits is None:
+        return None
+    return limits.deadline, limits.first_token_deadline
+
+class _ProgressLimits(GenerationLimits):
+    """GenerationLimits that report progress to the API process from check()
+
+    Backends call check() between tokens, so a long non-streamed generate()
+    still shows the supervisor it is alive and is not mistaken for a stall.
+    """
+
+    def __init__(self, on_progress):
+        super().__init__()
+        self._on_progress = on_progress
+        self._last_report = 0.0
+
+    def check(self, tokens_generated):
+        now = time.time()
+        if now - self._last_report >= HEARTBEAT_INTERVAL:
+            self._last_report = now
+            self._on_progress()
+        return super().check(tokens_generated)
+
+def _limits_from_spec(spec, on_progress):
+    limits = _ProgressLimits(on_progress)
+    if spec is not None:
+        limits.deadline, limits.first_token_deadline = spec
+    return limits
+
+def _raise_remote(message):
+    """Re-raise an ('error', ...) reply from the child"""
+    _, _, name, text, status = message
+    cls = _REMOTE_ERRORS.get(name)
+    if cls is not None:
+        raise cls(text)
+    if status is not None:
+        error = GenerationAborted(text)
+        error.status_code = status
+        raise error
+    raise Exception(text)
+
+class _Request:
+    """A call owned by a waiting caller thread; resubmitted if its worker dies"""
+
+    def __init__(self, request_id, op, args, kwargs, limits):
+        self.id = request_id
+        self.message = ('call', request_id, op, args, kwargs, _limits_spec(limits))
+        self.limits = limits
+        self.replies = queue.Queue()
+        self.last_progress = None  # None while waiting for a (re)started worker
+        self.attempts = 0
+        self.streamed = False
+
+class WorkerBackend(Backend):
+    """Backend proxy that runs kind ('llama-cpp', 'ollama', 'mock') in a supervised child"""
+
+    def __init__(self, kind, model_path, start_timeout=None, request_timeout=None,
+                 heartbeat_timeout=None, max_retries=None):
+        def pick(value, default):
+            return default if value is None else value
+
+        self.kind = kind
+        self.model_path = model_path
+        self.start_timeout = pick(start_timeout, config.WORKER_START_TIMEOUT)
+        self.request_timeout = pick(request_timeout, config.WORKER_REQUEST_TIMEOUT)
+        self.heartbeat_timeout = pick(heartbeat_timeout, config.WORKER_HEARTBEAT_TIMEOUT)
+        self.max_retries = pick(max_retries, config.WORKER_MAX_RETRIES)
+
+        self._lock = threading.Lock()  # guards _pending and sends on _conn
+        self._pending = {}
+        self._ids = itertools.count()
+        self._conn = None  # None while no worker is ready
+        self._proc = None
+        self._info = {}
+        self._last_seen = 0.0
+        self._failures = 0
+        self._closed = False
+        self.stats = {'restarts': 0, 'failovers': 0, 'failed_requests': 0}
+
+        error = self._start()
+        if error is not None:
+            raise RuntimeError(f"Backend worker failed to start: {error}")
+        self.name = self._info['name']
+        self.tuning = self._info['tuning']
+        atexit.register(self.close)
+        threading.Thread(target=self._supervise, name='backend-worker', daemon=True).start()
+        print(f"✅ Running {kind} backend in worker process (pid {self._proc.pid})")
+
+    # Backend protocol
+
+    def generate(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+                 stop=None, limits=None):
+        return self._call('generate', (prompt, max_tokens, temperature),
+                          {'response_format': response_format, 'stop': stop}, limits)
+
+    def stream(self, prompt, max_tokens=150, temperature=0.7, response_format=None,
+               stop=None, limits=None):
+        request = self._submit('stream', (prompt, max_tokens, temperature),
+                               {'response_format': response_format, 'stop': stop}, limits)
+        try:
+            while True:
+                message = self._reply(request)
+                if message[0] == 'error':
+                    _raise_remote(message)
+                if message[0] == 'done':
+                    return
+                yield message[2]
+        finally:
+            # No-op once the child has finished; otherwise stop it generating
+            self._abandon(request)
+
+    def tokenize(self, text):
+        return self._call('tokenize', (text,))
+
+    def embed(self, text):
+        return self._call('embed', (text,))
+
+    def health(self):
+        worker = self.worker_info()
+        if worker['pid'] is None:
+            return {'status': 'restarting', 'worker': worker}
+        try:
+            backend = self._call('health', timeout=2)
+        except GenerationAborted:
+            backend = {'status': 'unavailable'}
+        return {**backend, 'worker': worker}
+
+    def capabilities(self):
+        return {**self._info['capabilities'], 'isolated': True}
+
+    def upstream_info(self):
+        try:
+            backend = self._call('upstream_info', timeout=2) if self._conn is not None else None
+        except GenerationAborted:
+            backend = None
+        return {'worker': self.worker_info(), 'backend': backend}
+
+    def close(self):
+        """Stop the worker for good (runs at interpreter exit)"""
+        self._closed = True
+        self._kill()
+
+    def worker_info(self):
+        """Child pid (None while restarting), restarts, failovers and in-flight calls"""
+        with self._lock:
+            return {
+                'pid': self._proc.pid if self._conn is not None else None,
+                'in_flight': len(self._pending),
+                **self.stats
+            }
+
+    # Caller side
+
+    def _submit(self, op, args=(), kwargs=None, limits=None):
+        with self._lock:
+            request = _Request(next(self._ids), op, args, kwargs or {}, limits)
+            self._pending[request.id] = request
+            self._send(request)
+        return request
+
+    def _send(self, request):
+        """Send request to the current worker, if any; caller holds _lock"""
+        if self._conn is None:
+            return
+        try:
+            self._conn.send(request.message)
+            request.last_progress = time.time()
+        except (OSError, ValueError):
+            pass  # The worker is going down; the supervisor resubmits after restart
+
+    def _call(self, op, args=(), kwargs=None, limits=None, timeout=None):
+        request = self._submit(op, args, kwargs, limits)
+        try:
+            message = self._reply(request, timeout)
+        finally:
+            self._abandon(request)
+        if message[0] == 'error':
+            _raise_remote(message)
+        return message[2]
+
+    def _reply(self, request, timeout=None):
+        """Next message for request
+
+        Forwards cancellation to the worker. While the request is waiting for
+        a restarted worker its own limits apply here; once it runs, the child
+        enforces them.
+        """
+        give_up = time.time() + timeout if timeout is not None else None
+        cancel_forwarded = False
+        while True:
+            try:
+                return request.replies.get(timeout=0.1)
+            except queue.Empty:
+                pass
+            if give_up is not None and time.time() > give_up:
+                raise WorkerUnavailable(f"Backend worker did not answer {request.message[2]} in time")
+            limits = request.limits
+            if limits is None:
+                continue
+
+            with self._lock:
+                queued = request.id in self._pending and request.last_progress is None
+                expired = queued and limits.check(0) is not None
+                if expired:
+                    del self._pending[request.id]
+                elif limits.cancel_event.is_set() and not cancel_forwarded and not queued:
+                    cancel_forwarded = True
+                    self._send_cancel(request)
+            if expired:
+                limits.raise_if_fatal()
+                raise WorkerUnavailable("Request budget expired while the backend worker restarted")
+
+    def _send_cancel(self, request):
+        """Caller holds _lock"""
+        if self._conn is None:
+            return
+        try:
+            self._conn.send(('cancel', request.id))
+        except (OSError, ValueError):
+            pass
+
+    def _abandon(self, request):
+        """Forget a request whose caller stopped waiting, cancelling it in the worker"""
+        with self._lock:
+            if self._pending.pop(request.id, None) is not None and request.last_progress is not None:
+                self._send_cancel(request)
+
+    # Supervisor
+
+    def _start(self):
+        """Launch a child and wait until its backend is loaded; returns an error or None"""
+        parent_sock, child_sock = socket.socketpair()
+        self._proc = subprocess.Popen(
+            [sys.executable, '-u', os.path.abspath(__file__), '--backend', self.kind,
+             '--model-path', self.model_path, '--fd', str(child_sock.fileno())],
+            pass_fds=[child_sock.fileno()]
+        )
+        child_sock.close()
+        conn = Connection(parent_sock.detach())
+
+        deadline = time.time() + self.start_timeout
+        error = f"not ready after {self.start_timeout:.0f}s"
+        while time.time() < deadline:
+            try:
+                if conn.poll(0.25):
+                    message = conn.recv()
+                    if message[0] == 'ready':
+                        self._info = message[1]
+                        with self._lock:
+                            self._last_seen = time.time()
+                            self._conn = conn
+                        return None
+                    if message[0] == 'failed':
+                        error = message[1]
+                        break
+            except (EOFError, OSError):
+                pass
+            if self._proc.poll() is not None:
+                error = f"exited with code {self._proc.returncode} while loading"
+                break
+        conn.close()
+        self._kill()
+        return error
+
+    def _kill(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+    def _supervise(self):
+        while True:
+            reason, culprits = self._serve()
+            if self._closed:
+                return
+            self._fail_over(reason, culprits)
+            while True:
+                time.sleep(min(RESTART_BACKOFF_MAX, 2 ** self._failures - 1))
+                self.stats['restarts'] += 1
+                error = self._start()
+                if error is None:
+                    break
+                self._failures += 1
+                print(f"❌ Backend worker restart failed: {error}")
+            print(f"✅ Backend worker restarted (pid {self._proc.pid})")
+            with self._lock:
+                for request in self._pending.values():
+                    if request.last_progress is None:
+                        self._send(request)
+
+    def _serve(self):
+        """Route replies to callers until the worker dies or stalls; returns (reason, culprits)"""
+        conn = self._conn
+        while True:
+            try:
+                while conn.poll(0.25):
+                    self._route(conn.recv())
+                    self._last_seen = time.time()
+            except (EOFError, OSError):
+                return 'closed the connection', []
+            if self._proc.poll() is not None:
+                return f"exited with code {self._proc.returncode}", []
+
+            now = time.time()
+            if now - self._last_seen > self.heartbeat_timeout:
+                return f"sent no heartbeat for {self.heartbeat_timeout:.0f}s", []
+            with self._lock:
+                stalled = [r for r in self._pending.values()
+                           if r.last_progress is not None and now - r.last_progress > self.request_timeout]
+            if stalled:
+                return f"made no progress on a request for {self.request_timeout:.0f}s", stalled
+
+    def _route(self, message):
+        if message[0] == 'heartbeat':
+            return
+        with self._lock:
+            request = self._pending.get(message[1])
+            if request is None:
+                return  # The caller already gave up
+            if message[0] == 'progress':
+                if request.last_progress is not None:
+                    request.last_progress = time.time()
+                return
+            if message[0] == 'chunk':
+                request.streamed = True
+                request.last_progress = time.time()
+            else:
+                del self._pending[message[1]]
+        if message[0] in ('result', 'done'):
+            self._failures = 0
+        request.replies.put(message)
+
+    def _fail_over(self, reason, culprits):
+        """Kill the worker and requeue (or fail) the requests that were running on it"""
+        print(f"❌ Backend worker (pid {self._proc.pid}) {reason}; restarting")
+        self._failures += 1
+        with self._lock:
+            conn, self._conn = self._conn, None
+            for request in list(self._pending.values()):
+                if request.last_progress is None:
+                    continue
+                # Partly streamed output cannot be replayed, and a request that
+                # stalled the worker would most likely stall the next one too
+                if request in culprits or request.streamed or request.attempts >= self.max_retries:
+                    del self._pending[request.id]
+                    self.stats['failed_requests'] += 1
+                    request.replies.put(('error', request.id, 'WorkerUnavailable',
+                                         f"Backend worker {reason}", None))
+                else:
+                    request.attempts += 1
+                    request.last_progress = None
+                    self.stats['failovers'] += 1
+        self._kill()
+        conn.close()
+
+# Child process
+
+def serve(conn, kind, model_path):
+    """Load the backend and run calls from the API process until it hangs up"""
+    try:
+        backend = load_backend(kind, model_path)
+    except Exception as e:
+        conn.send(('failed', str(e)))
+        return
+    conn.send(('ready', {
+        'name': backend.name,
+        'tuning': backend.tuning,
+        'capabilities': backend.capabilities()
+    }))
+
+    send_lock = threading.Lock()
+    cancel_events = {}
+
+    def send(message):
+        try:
+            with send_lock:
+                conn.send(message)
+        except OSError:
+            pass  # The API process is gone; the recv loop below ends too
+
+    def heartbeat():
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            send(('heartbeat',))
+
+    def run(request_id, op, args, kwargs):
+        try:
+            if op not in OPS:
+                raise ValueError(f"Unsupported worker operation {op!r}")
+            if op == 'stream':
+                for chunk in backend.stream(*args, **kwargs):
+                    send(('chunk', request_id, chunk))
+                send(('done', request_id))
+            else:
+                send(('result', request_id, getattr(backend, op)(*args, **kwargs)))
+        except Exception as e:
+            send(('error', request_id, type(e).__name__, str(e), getattr(e, 'status_code', None)))
+        finally:
+            cancel_events.pop(request_id, None)
+
+    threading.Thread(target=heartbeat, name='heartbeat', daemon=True).start()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == 'cancel':
+            event = cancel_events.get(message[1])
+            if event is not None:
+                event.set()
+            continue
+        _, request_id, op, args, kwargs, spec = message
+        if op in ('generate', 'stream'):
+            kwargs['limits'] = _limits_from_spec(spec, lambda i=request_id: send(('progress', i)))
+            cancel_events[request_id] = kwargs['limits'].cancel_event
+        threading.Thread(target=run, args=(request_id, op, args, kwargs), daemon=True).start()
+
+def main():
+    parser = argparse.ArgumentParser(description='Backend worker process (started by WorkerBackend)')
+    parser.add_argument('--backend', required=True, choices=BACKENDS)
+    parser.add_argument('--model-path', required=True)
+    parser.add_argument('--fd', type=int, required=True, help='Inherited socket to the API process')
+    args = parser.parse_args()
+
+    try:
+        serve(Connection(args.fd), args.backend, args.model_path)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
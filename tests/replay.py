@@ -0,0 +1,240 @@
+"""Replay captured traffic against a server and compare with the recording
+
+Reads trace files written with TRACE_CAPTURE=true (or audit logs, which
+carry the same fields plus the text) and re-sends every request on the
+original schedule, optionally sped up, with the recorded parameters. Prompts
+come from a synthetic corpus with the recorded word count; requests that
+shared a prompt in the recording share a synthetic prompt in the replay, so
+exact-repeat cache hits carry over. The report compares latency, throughput
+and cache hit rate with what the recording saw.
+
+Latency is measured from the scheduled send time, so requests the client
+could not send on time still count their wait.
+
+Usage:
+    python tests/replay.py logs/trace --url http://localhost:8080
+    python tests/replay.py logs/trace/trace-*.jsonl.gz --speed 2 --limit 500
+    python tests/replay.py logs/audit --real-prompts --output replay.json
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+VOCABULARY = (
+    "explain describe summarize list compare write outline name how what why when which "
+    "docker kubernetes container cluster pod node service deployment cloud storage network "
+    "python function class list sort search cache queue database index query latency "
+    "throughput scaling load balancer request response server client memory cpu thread "
+    "process model token prompt inference batch stream error retry timeout health metric "
+    "the a an of to in for with on and or is are this that it from by as be can should "
+    "simple example short detailed step steps best practice difference between using use"
+).split()
+
+def trace_files(paths):
+    """Expand directories into their .jsonl / .jsonl.gz files, oldest name first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.endswith(('.jsonl', '.jsonl.gz')))
+        else:
+            files.append(path)
+    return files
+
+def load_trace(paths):
+    """Trace records sorted by timestamp; audit log records are reduced to the same shape"""
+    records, skipped = [], 0
+    for path in trace_files(paths):
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    if isinstance(record, dict) and 'timestamp' in record:
+                        records.append(normalize(record))
+                    else:
+                        skipped += 1
+        except (OSError, EOFError) as e:
+            # A file cut short by a crash still has its complete batches
+            print(f"⚠️  {path}: {e}")
+    records.sort(key=lambda r: r['timestamp'])
+    return records, skipped
+
+def normalize(record):
+    prompt = record.get('prompt')
+    if isinstance(prompt, str) and 'prompt_words' not in record:
+        record['prompt_chars'] = len(prompt)
+        record['prompt_words'] = len(prompt.split())
+        record['prompt_hash'] = f"{zlib.crc32(prompt.encode('utf-8')):08x}"
+    record.setdefault('prompt_chars', 0)
+    record.setdefault('prompt_words', 0)
+    record.setdefault('prompt_hash', record.get('request_id', ''))
+    record['params'] = record.get('params') or {}
+    return record
+
+def synthetic_prompt(record):
+    """Same hash -> same prompt, with the recorded number of words"""
+    rng = random.Random(record['prompt_hash'])
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(max(1, record['prompt_words'])))
+
+def build_body(record, real_prompts):
+    body = dict(record['params'])
+    body.pop('invalid_body', None)
+    if record['prompt_chars']:
+        if real_prompts and isinstance(record.get('prompt'), str):
+            body['prompt'] = record['prompt']
+        else:
+            body['prompt'] = synthetic_prompt(record)
+    return body
+
+def replay(records, url, speed, max_in_flight, real_prompts, timeout):
+    """Send every record at its (scaled) original offset; returns one result per record"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_in_flight)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    results = [None] * len(records)
+    origin = records[0]['timestamp']
+    lock = threading.Lock()
+    progress = {'done': 0}
+
+    def send(i, body, scheduled):
+        try:
+            response = session.post(f"{url}/chat", json=body, timeout=timeout)
+            status = response.status_code
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+        except requests.exceptions.RequestException as e:
+            status, data = None, {'error': str(e)}
+        results[i] = {
+            'timestamp': scheduled,
+            'status': status,
+            'client_latency': time.time() - scheduled,
+            'latency_seconds': data.get('latency_seconds'),
+            'tokens_generated': data.get('tokens_generated'),
+            'finish_reason': data.get('finish_reason'),
+            'cached': data.get('cached', False)
+        }
+        with lock:
+            progress['done'] += 1
+            if progress['done'] % 50 == 0 or progress['done'] == len(records):
+                print(f"  Progress: {progress['done']}/{len(records)} completed...")
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for i, record in enumerate(records):
+            scheduled = start + (record['timestamp'] - origin) / speed
+            time.sleep(max(0.0, scheduled - time.time()))
+            executor.submit(send, i, build_body(record, real_prompts), scheduled)
+    return results
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+def summarize(results, latency_key='latency_seconds'):
+    """Latency, throughput and cache figures for recorded or replayed results"""
+    ok = [r for r in results if r['status'] == 200]
+    latencies = sorted(r[latency_key] for r in ok if r.get(latency_key) is not None)
+    tokens = [r['tokens_generated'] or 0 for r in ok]
+    first = min(r['timestamp'] for r in results)
+    last = max(r['timestamp'] + (r.get(latency_key) or 0) for r in results)
+    duration = max(last - first, 1e-9)
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'errors': len(results) - len(ok),
+        'duration_seconds': duration,
+        'throughput_rps': len(ok) / duration,
+        'tokens_per_second': sum(tokens) / duration,
+        'mean_tokens': statistics.mean(tokens) if tokens else None,
+        'latency_mean': statistics.mean(latencies) if latencies else None,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99),
+        'cache_hit_rate': sum(1 for r in ok if r.get('cached')) / len(ok) if ok else None,
+        'truncated_rate': (sum(1 for r in ok if r.get('finish_reason') in ('length', 'time_limit')) / len(ok)
+                           if ok else None)
+    }
+
+def print_report(recorded, replayed, client, speed):
+    rows = [
+        ('Requests', 'requests', '{:.0f}'),
+        ('Successful', 'ok', '{:.0f}'),
+        ('Errors', 'errors', '{:.0f}'),
+        ('Duration (s)', 'duration_seconds', '{:.1f}'),
+        ('Throughput (req/s)', 'throughput_rps', '{:.2f}'),
+        ('Tokens/s', 'tokens_per_second', '{:.1f}'),
+        ('Mean tokens', 'mean_tokens', '{:.1f}'),
+        ('Latency mean (s)', 'latency_mean', '{:.3f}'),
+        ('Latency p50 (s)', 'latency_p50', '{:.3f}'),
+        ('Latency p95 (s)', 'latency_p95', '{:.3f}'),
+        ('Latency p99 (s)', 'latency_p99', '{:.3f}'),
+        ('Cache hit rate', 'cache_hit_rate', '{:.1%}'),
+        ('Truncated rate', 'truncated_rate', '{:.1%}')
+    ]
+    fmt = lambda spec, value: spec.format(value) if value is not None else '-'
+
+    print(f"\n📊 Replay vs recording (speed x{speed:g}; latencies are server-side)")
+    print(f"{'':<22}{'recorded':>12}{'replay':>12}{'change':>10}")
+    for label, key, spec in rows:
+        before, after = recorded[key], replayed[key]
+        change = f"{(after - before) / before:+.0%}" if before and after is not None else ''
+        print(f"{label:<22}{fmt(spec, before):>12}{fmt(spec, after):>12}{change:>10}")
+    print(f"\n⏱️  Client-side latency from scheduled send: p50 {fmt('{:.3f}', client['latency_p50'])}s, "
+          f"p95 {fmt('{:.3f}', client['latency_p95'])}s, p99 {fmt('{:.3f}', client['latency_p99'])}s")
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a captured trace and compare with the recording')
+    parser.add_argument('traces', nargs='+', help='Trace or audit log files, or directories of them')
+    parser.add_argument('--url', default='http://localhost:8080', help='Server to replay against')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Time compression: 2 sends the same requests in half the time (default: 1)')
+    parser.add_argument('--limit', type=int, help='Replay only the first N requests')
+    parser.add_argument('--max-in-flight', type=int, default=256,
+                        help='Client threads; later requests wait (and count the wait) beyond this')
+    parser.add_argument('--real-prompts', action='store_true',
+                        help='Send the original text when the records have it (audit logs)')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='Write both summaries to this JSON file')
+    args = parser.parse_args()
+
+    records, skipped = load_trace(args.traces)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        parser.error('no trace records found')
+    span = records[-1]['timestamp'] - records[0]['timestamp']
+    repeats = len(records) - len({r['prompt_hash'] for r in records})
+    print(f"📼 Loaded {len(records)} requests spanning {span:.1f}s "
+          f"({repeats} repeated prompts, {skipped} unreadable lines skipped)")
+    print(f"🚀 Replaying against {args.url} over ~{span / args.speed:.1f}s...")
+
+    results = replay(records, args.url, args.speed, args.max_in_flight, args.real_prompts, args.timeout)
+    recorded = summarize(records)
+    replayed = summarize(results)
+    client = summarize(results, latency_key='client_latency')
+    print_report(recorded, replayed, client, args.speed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'speed': args.speed, 'url': args.url, 'recorded': recorded,
+                       'replay': replayed, 'replay_client': client}, f, indent=2)
+        print(f"\n✅ Report saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
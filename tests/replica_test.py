@@ -0,0 +1,144 @@
+"""Compare round-robin against llm_client routing over several mock replicas
+
+Starts N local mock-backend servers (one of them slower, all with occasional
+latency spikes), then sends the same load twice: once round-robin over the
+replicas, like a Kubernetes Service, and once through LLMClient with
+least-loaded routing, hedging and retries.
+
+Usage:
+    python tests/replica_test.py --replicas 3 --requests 120 --concurrency 6
+    python tests/replica_test.py --endpoints http://10.0.0.5:8080 http://10.0.0.6:8080
+"""
+import argparse
+import itertools
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from llm_client import LLMClient, LLMClientError  # noqa: E402
+
+PROMPTS = [
+    "Explain cloud computing",
+    "What is Kubernetes?",
+    "Write a Python function to sort a list",
+    "How do Docker containers work?"
+]
+
+def start_replicas(count, base_port, slow_factor, spike_rate):
+    """Launch mock servers on consecutive ports; the last one decodes slow_factor x slower"""
+    procs, endpoints = [], []
+    for i in range(count):
+        env = dict(os.environ, USE_MOCK='true', BACKEND='mock', API_PORT=str(base_port + i),
+                   MOCK_LOAD_TIME='0', MOCK_SEED=str(i), MOCK_SPIKE_RATE=str(spike_rate),
+                   MOCK_SPIKE_SECONDS='3')
+        if i == count - 1 and count > 1:
+            env['MOCK_DECODE_PER_TOKEN'] = str(0.045 * slow_factor)
+        procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'src', 'app.py')], env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        endpoints.append(f"http://127.0.0.1:{base_port + i}")
+
+    deadline = time.time() + 60
+    for url in endpoints:
+        while True:
+            try:
+                if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                    break
+            except requests.exceptions.RequestException:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"Replica {url} did not start")
+            time.sleep(0.2)
+    print(f"✅ Started {count} mock replicas: {', '.join(endpoints)}")
+    return procs, endpoints
+
+def run_load(send, num_requests, concurrency, max_tokens):
+    latencies, errors = [], 0
+    start = time.time()
+
+    def one(i):
+        t0 = time.time()
+        try:
+            send(PROMPTS[i % len(PROMPTS)], max_tokens)
+            return time.time() - t0, None
+        except Exception as e:
+            return time.time() - t0, e
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, error in executor.map(one, range(num_requests)):
+            if error is None:
+                latencies.append(latency)
+            else:
+                errors += 1
+    total = time.time() - start
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] if latencies else 0.0
+    return {
+        'successful': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / total,
+        'mean': statistics.mean(latencies) if latencies else 0.0,
+        'p50': pick(0.5),
+        'p95': pick(0.95),
+        'p99': pick(0.99)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Round-robin vs replica-aware client')
+    parser.add_argument('--endpoints', nargs='+', help='Use running replicas instead of starting mocks')
+    parser.add_argument('--replicas', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=8090)
+    parser.add_argument('--slow-factor', type=float, default=3.0,
+                        help='How much slower the last mock replica decodes (default: 3)')
+    parser.add_argument('--spike-rate', type=float, default=0.03,
+                        help='Fraction of mock requests with a 3s latency spike (default: 0.03)')
+    parser.add_argument('--requests', type=int, default=120)
+    parser.add_argument('--concurrency', type=int, default=6)
+    parser.add_argument('--max-tokens', type=int, default=20)
+    args = parser.parse_args()
+
+    procs, endpoints = [], args.endpoints
+    if not endpoints:
+        procs, endpoints = start_replicas(args.replicas, args.base_port, args.slow_factor,
+                                          args.spike_rate)
+    try:
+        session = requests.Session()
+        rotation = itertools.cycle(endpoints)
+
+        def round_robin(prompt, max_tokens):
+            response = session.post(f"{next(rotation)}/chat",
+                                    json={'prompt': prompt, 'max_tokens': max_tokens}, timeout=120)
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}")
+
+        print(f"\n🔁 Round-robin: {args.requests} requests, {args.concurrency} concurrent")
+        results = {'round-robin': run_load(round_robin, args.requests, args.concurrency, args.max_tokens)}
+
+        with LLMClient(endpoints, health_interval=0.5) as client:
+            print(f"🎯 llm_client: {args.requests} requests, {args.concurrency} concurrent")
+            results['llm_client'] = run_load(lambda p, m: client.chat(p, max_tokens=m),
+                                             args.requests, args.concurrency, args.max_tokens)
+            info = client.info()
+
+        print(f"\n{'':<14}{'ok':>6}{'err':>6}{'req/s':>8}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}")
+        for name, r in results.items():
+            print(f"{name:<14}{r['successful']:>6}{r['errors']:>6}{r['throughput']:>8.2f}"
+                  f"{r['mean']:>8.2f}{r['p50']:>8.2f}{r['p95']:>8.2f}{r['p99']:>8.2f}")
+        print(f"\n📊 Client: {info['retries']} retries, {info['hedges']} hedges "
+              f"({info['hedge_wins']} won), {info['budget_exhausted']} over budget")
+        for replica in info['replicas']:
+            print(f"   {replica['url']}: {replica['requests']} requests, {replica['errors']} errors")
+    except LLMClientError as e:
+        print(f"❌ {e}")
+    finally:
+        for proc in procs:
+            proc.terminate()
+
+if __name__ == '__main__':
+    main()
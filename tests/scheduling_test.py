@@ -0,0 +1,144 @@
+"""Latency with the output-length predictor on (SJF admission) and off (FIFO)
+
+Starts two identical mock servers whose output length depends on the prompt
+(MOCK_LENGTH_SKEW), one with LENGTH_PREDICTOR=true and one with false. Both
+are warmed up with the same prompts so the predictor can learn, then receive
+the same open-loop Poisson arrival schedule at the target utilization.
+
+Usage:
+    python tests/scheduling_test.py --requests 300 --utilization 0.85
+"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# The mock scales output length by the leading word, so these are the "task types"
+TASKS = ['summarize', 'explain', 'list', 'describe', 'name', 'write', 'compare', 'outline']
+TOPICS = ['docker', 'kubernetes', 'cloud storage', 'autoscaling', 'load balancers', 'python']
+
+def make_prompts(count, seed):
+    rng = random.Random(seed)
+    return [f"{rng.choice(TASKS)} {rng.choice(TOPICS)} for request {i}" for i in range(count)]
+
+def start_server(port, predictor, args):
+    env = dict(os.environ, USE_MOCK='true', BACKEND='mock', API_PORT=str(port),
+               MOCK_LOAD_TIME='0', MOCK_SEED='7', MOCK_LENGTH_SKEW=str(args.skew),
+               MOCK_OUTPUT_TOKENS=str(args.output_tokens),
+               MOCK_DECODE_PER_TOKEN=str(args.decode_per_token),
+               LENGTH_PREDICTOR='true' if predictor else 'false')
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'src', 'app.py')], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return proc, url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"Server on port {port} did not start")
+
+def send(url, prompt, max_tokens):
+    start = time.time()
+    response = requests.post(f"{url}/chat", json={'prompt': prompt, 'max_tokens': max_tokens},
+                             timeout=600)
+    latency = time.time() - start
+    return latency if response.status_code == 200 else None
+
+def summarize(latencies):
+    ok = sorted(l for l in latencies if l is not None)
+    pick = lambda q: ok[min(len(ok) - 1, int(len(ok) * q))] if ok else 0.0
+    return {
+        'ok': len(ok),
+        'errors': len(latencies) - len(ok),
+        'mean': statistics.mean(ok) if ok else 0.0,
+        'p50': pick(0.5),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'max': ok[-1] if ok else 0.0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Mean and tail latency with the length predictor on and off')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=100, help='Sequential requests to train the predictor')
+    parser.add_argument('--utilization', type=float, default=0.85)
+    parser.add_argument('--skew', type=float, default=1.2, help='MOCK_LENGTH_SKEW (default: 1.2)')
+    parser.add_argument('--output-tokens', type=int, default=60)
+    parser.add_argument('--decode-per-token', type=float, default=0.004)
+    parser.add_argument('--max-tokens', type=int, default=500)
+    parser.add_argument('--base-port', type=int, default=8095)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    servers = {}
+    try:
+        for offset, (name, predictor) in enumerate((('predictor off', False), ('predictor on', True))):
+            servers[name] = start_server(args.base_port + offset, predictor, args)
+        print(f"✅ Started mock servers: {', '.join(f'{n} {u}' for n, (_, u) in servers.items())}")
+
+        # Warm up both servers identically; also measures the mean service time
+        print(f"🔥 Warm-up: {args.warmup} sequential requests per server")
+        warmup = {name: [] for name in servers}
+
+        def warm(name, url):
+            for prompt in make_prompts(args.warmup, args.seed + 1):
+                warmup[name].append(send(url, prompt, args.max_tokens))
+
+        threads = [threading.Thread(target=warm, args=(n, u)) for n, (_, u) in servers.items()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        completed = [l for l in warmup['predictor off'] if l is not None]
+        if not completed:
+            print("❌ Every warm-up request failed")
+            return
+        service = statistics.mean(completed)
+        rate = args.utilization / service
+        print(f"   Mean service time {service:.3f}s -> {rate:.2f} req/s for {args.utilization:.0%} utilization")
+
+        # Same open-loop Poisson schedule against both servers
+        rng = random.Random(args.seed)
+        prompts = make_prompts(args.requests, args.seed)
+        latencies = {name: [None] * args.requests for name in servers}
+        threads = []
+        print(f"🚀 Sending {args.requests} requests to each server...")
+        next_at = time.time()
+        for i, prompt in enumerate(prompts):
+            next_at += rng.expovariate(rate)
+            time.sleep(max(0.0, next_at - time.time()))
+            for name, (_, url) in servers.items():
+                def run(name=name, url=url, i=i, prompt=prompt):
+                    latencies[name][i] = send(url, prompt, args.max_tokens)
+                thread = threading.Thread(target=run)
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        print(f"\n{'':<16}{'ok':>6}{'err':>6}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+        for name in servers:
+            r = summarize(latencies[name])
+            print(f"{name:<16}{r['ok']:>6}{r['errors']:>6}{r['mean']:>8.2f}{r['p50']:>8.2f}"
+                  f"{r['p95']:>8.2f}{r['p99']:>8.2f}{r['max']:>8.2f}")
+        predictor = requests.get(f"{servers['predictor on'][1]}/metrics", timeout=5).json()['length_predictor']
+        print(f"\n📊 Predictor: {predictor['observations']} observations, "
+              f"mean abs error {predictor['mean_abs_error_tokens']} tokens")
+    finally:
+        for proc, _ in servers.values():
+            proc.terminate()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Checks for src/dispatcher.py with a fake upstream call
+
+Usage:
+    python -m pytest tests/test_dispatcher.py
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from dispatcher import QueueTimeout, SlotQueue, UpstreamDispatcher  # noqa: E402
+from generation import GenerationCancelled, GenerationLimits  # noqa: E402
+
+SERVICE = 0.2
+
+class FakeUpstream:
+    """Upstream call that blocks until released and counts concurrency"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.running = 0
+        self.peak = 0
+
+    def __call__(self, result='ok'):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            assert self.release.wait(5)
+            return result
+        finally:
+            with self.lock:
+                self.running -= 1
+
+def start(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+def run_concurrently(count, target):
+    threads = [start(target, i) for i in range(count)]
+    for t in threads:
+        t.join(10)
+
+def test_concurrency_stays_within_slots():
+    dispatcher = UpstreamDispatcher(2, poll_interval=0.01)
+    upstream = FakeUpstream()
+    results = []
+    threads = [start(lambda: results.append(dispatcher.submit(upstream))) for _ in range(6)]
+    wait_for(lambda: dispatcher.info()['queue_depth'] == 4)
+    assert upstream.running == 2
+    upstream.release.set()
+    for t in threads:
+        t.join(5)
+    assert results == ['ok'] * 6
+    assert upstream.peak == 2
+    assert dispatcher.info()['running'] == 0
+
+def test_slots_are_handed_over_in_arrival_order():
+    queue = SlotQueue(1, poll_interval=0.01)
+    holder = queue.acquire()
+    order = []
+
+    def waiter(i):
+        ticket = queue.acquire()
+        order.append(i)
+        queue.release(ticket)
+
+    for i in range(4):
+        start(waiter, i)
+        wait_for(lambda: queue.queue_depth == i + 1)
+    queue.release(holder)
+    wait_for(lambda: len(order) == 4)
+    assert order == [0, 1, 2, 3]
+
+def test_identical_keys_share_one_upstream_call():
+    dispatcher = UpstreamDispatcher(1, poll_interval=0.01)
+    upstream = FakeUpstream()
+    results = []
+    threads = [start(lambda: results.append(dispatcher.submit(upstream, key='same'))) for _ in range(4)]
+    wait_for(lambda: dispatcher.info()['coalesced'] == 3)
+    upstream.release.set()
+    for t in threads:
+        t.join(5)
+    assert results == ['ok'] * 4
+    assert upstream.calls == 1
+
+def test_follower_runs_its_own_call_when_the_leader_is_cancelled():
+    dispatcher = UpstreamDispatcher(1, poll_interval=0.01)
+    upstream = FakeUpstream()
+    cancelled = threading.Event()
+
+    def leader_call():
+        assert cancelled.wait(5)
+        raise GenerationCancelled("Client disconnected; generation aborted")
+
+    errors, results = [], []
+
+    def leader():
+        try:
+            dispatcher.submit(leader_call, key='same')
+        except GenerationCancelled as e:
+            errors.append(e)
+
+    threads = [start(leader)]
+    wait_for(lambda: dispatcher.info()['running'] == 1)
+    threads.append(start(lambda: results.append(dispatcher.submit(upstream, key='same'))))
+    wait_for(lambda: dispatcher.info()['coalesced'] == 1)
+    cancelled.set()
+    upstream.release.set()
+    for t in threads:
+        t.join(5)
+    assert len(errors) == 1
+    assert results == ['ok']
+    assert upstream.calls == 1
+    assert dispatcher.info()['upstream_calls'] == 2
+
+def test_deadline_while_queued_raises_and_releases_nothing():
+    dispatcher = UpstreamDispatcher(1, poll_interval=0.01)
+    upstream = FakeUpstream()
+    holder = start(dispatcher.submit, upstream)
+    wait_for(lambda: upstream.running == 1)
+
+    with pytest.raises(QueueTimeout):
+        dispatcher.submit(upstream, limits=GenerationLimits(timeout_seconds=0.05))
+    info = dispatcher.info()
+    assert (info['running'], info['queue_depth'], info['queue_timeouts']) == (1, 0, 1)
+    assert dispatcher._slots._free == 0
+
+    upstream.release.set()
+    holder.join(5)
+    assert dispatcher._slots._free == 1
+    assert upstream.calls == 1
+
+def test_slot_handed_over_as_the_limit_fires_is_passed_on():
+    queue = SlotQueue(1, poll_interval=0.01)
+    holder = queue.acquire()
+
+    class ExpiresOnHandover:
+        """The slot arrives in the same instant the budget runs out"""
+        reason = None
+
+        def check(self, tokens_generated):
+            queue.release(holder)
+            self.reason = 'time_limit'
+            return self.reason
+
+        def raise_if_fatal(self):
+            pass
+
+    with pytest.raises(QueueTimeout):
+        queue.acquire(ExpiresOnHandover())
+    assert queue.info()['running'] == 0
+    assert queue._free == 1
+    ticket = queue.acquire()
+    queue.release(ticket)
+
+def test_queue_wait_is_separated_from_service_time():
+    dispatcher = UpstreamDispatcher(1, poll_interval=0.01)
+    service = [None] * 3
+
+    def request(i):
+        limits = GenerationLimits()
+        start_time = time.time()
+        dispatcher.submit(lambda: time.sleep(SERVICE), limits=limits)
+        service[i] = time.time() - start_time - limits.queue_wait
+
+    run_concurrently(3, request)
+    # Every request waited behind the others but spent one service time upstream
+    assert all(abs(s - SERVICE) < 0.1 for s in service), service
@@ -0,0 +1,63 @@
+"""Checks for llm_client against a local keep-alive server
+
+Usage:
+    python -m pytest tests/test_llm_client.py
+"""
+import json
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from llm_client import LLMClient  # noqa: E402
+
+BODY = json.dumps({'response': 'ok'}).encode()
+REPLY = b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s' % (len(BODY), BODY)
+
+def read_request(f):
+    """Consume one request; False at end of stream"""
+    length = 0
+    while True:
+        line = f.readline()
+        if not line:
+            return False
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+        if line in (b'\r\n', b'\n'):
+            break
+    f.read(length)
+    return True
+
+def serve(conn):
+    with conn, conn.makefile('rb') as f:
+        if read_request(f):
+            conn.sendall(REPLY)
+            # The idle timeout races the next request: it is read, then the connection drops
+            read_request(f)
+
+@pytest.fixture
+def url():
+    listener = socket.create_server(('127.0.0.1', 0))
+
+    def accept():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield f"http://127.0.0.1:{listener.getsockname()[1]}"
+    listener.close()
+
+def test_stale_pooled_connection_is_reopened_without_a_retry(url):
+    with LLMClient([url], hedge_after=None, health_interval=0) as client:
+        for _ in range(4):
+            assert client.chat('hi') == {'response': 'ok'}
+        info = client.info()
+    assert info['retries'] == 0
+    assert info['replicas'][0]['errors'] == 0
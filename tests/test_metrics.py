@@ -0,0 +1,44 @@
+"""Checks for src/metrics.py
+
+Usage:
+    python -m pytest tests/test_metrics.py
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from metrics import NUM_SHARDS, MetricsAggregator  # noqa: E402
+
+def test_concurrent_threads_spread_across_shards():
+    metrics = MetricsAggregator()
+    barrier = threading.Barrier(NUM_SHARDS)
+    used = set()
+
+    def work():
+        # Keep every thread alive at once so idents are not reused
+        barrier.wait()
+        metrics.record(0.1, tokens=5)
+        used.add(id(metrics._shard()))
+        barrier.wait()
+
+    threads = [threading.Thread(target=work) for _ in range(NUM_SHARDS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(used) == NUM_SHARDS
+    assert metrics.totals()['total_requests'] == NUM_SHARDS
+
+def test_thread_keeps_its_shard():
+    metrics = MetricsAggregator()
+    assert metrics._shard() is metrics._shard()
+
+def test_service_time_excludes_queueing_and_cache_hits():
+    metrics = MetricsAggregator()
+    metrics.record(5.0, tokens=10, service_seconds=1.0)
+    metrics.record(3.0, tokens=10, service_seconds=2.0)
+    metrics.record(0.01)
+    assert metrics.totals()['average_service_seconds'] == 1.5
+    assert metrics.window(60)['avg_service_seconds'] == 1.5
+    assert MetricsAggregator().totals()['average_service_seconds'] is None
@@ -0,0 +1,146 @@
+"""Checks for src/model_fetch.py against a local HTTP server
+
+Usage:
+    python -m pytest tests/test_model_fetch.py
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from model_fetch import (ModelFetchError, RangedDownloader, fetch, published_sha256,  # noqa: E402
+                         url_key)
+
+DATA = os.urandom(300 * 1024 + 123)
+DIGEST = hashlib.sha256(DATA).hexdigest()
+CHUNK = 64 * 1024
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves DATA with range support; the server's attributes script failures"""
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, length):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        if self.server.published is not None:
+            self.send_header('X-Linked-Etag', f'"{self.server.published}"')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(DATA))
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        if header is None:
+            self.server.requests.append(None)
+            self._headers(200, len(DATA))
+            self.wfile.write(DATA)
+            return
+        start, _, end = header[len('bytes='):].partition('-')
+        start, end = int(start), int(end) if end else len(DATA) - 1
+        self.server.requests.append(start)
+        if start in self.server.fail_once:
+            self.server.fail_once.discard(start)
+            self.send_error(500)
+            return
+        self._headers(206, end - start + 1)
+        self.wfile.write(DATA[start:end + 1])
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.requests, httpd.fail_once, httpd.published = [], set(), None
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/model.gguf"
+    yield httpd
+    httpd.shutdown()
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_ranged_download(server, tmp_path):
+    part = str(tmp_path / 'model.part')
+    RangedDownloader(server.url, part, workers=3, chunk_size=CHUNK).download()
+    assert read(part) == DATA
+    assert sorted(server.requests) == list(range(0, len(DATA), CHUNK))
+
+def test_interrupted_download_resumes(server, tmp_path):
+    part = str(tmp_path / 'model.part')
+    server.fail_once = {2 * CHUNK, 4 * CHUNK}
+    with pytest.raises(ModelFetchError):
+        RangedDownloader(server.url, part, workers=1, chunk_size=CHUNK).download()
+    assert os.path.exists(part + '.json')
+
+    server.requests.clear()
+    RangedDownloader(server.url, part, workers=1, chunk_size=CHUNK).download()
+    assert read(part) == DATA
+    # Only the chunks that failed are fetched again
+    assert sorted(server.requests) == [2 * CHUNK, 4 * CHUNK]
+    # Kept until the blob is committed, so a finished download is not repeated
+    server.requests.clear()
+    RangedDownloader(server.url, part, workers=1, chunk_size=CHUNK).download()
+    assert server.requests == []
+
+def write_part(part, data, validator):
+    with open(part, 'wb') as f:
+        f.write(data)
+    with open(part + '.json', 'w') as f:
+        json.dump({'size': len(DATA), 'validator': validator, 'stream': True}, f)
+
+def test_single_stream_resumes_only_the_same_remote_file(server, tmp_path):
+    part = str(tmp_path / 'model.part')
+    write_part(part, DATA[:1000], '"v1"')
+    RangedDownloader(server.url, part, chunk_size=len(DATA)).download()
+    assert read(part) == DATA
+    assert server.requests == [1000]
+
+    # Bytes saved for another version of the file are not spliced in
+    server.requests.clear()
+    write_part(part, b'x' * 1000, '"v0"')
+    RangedDownloader(server.url, part, chunk_size=len(DATA)).download()
+    assert read(part) == DATA
+    assert server.requests == [None]
+
+def test_finished_but_uncommitted_download_is_committed(server, tmp_path):
+    cache = str(tmp_path / 'cache')
+    part = os.path.join(cache, 'partial', url_key(server.url) + '.part')
+    os.makedirs(os.path.dirname(part))
+    write_part(part, DATA, '"v1"')
+    blob = fetch(server.url, str(tmp_path / 'm.gguf'), cache_dir=cache, chunk_mb=1)
+    assert read(blob) == DATA
+    assert server.requests == []
+    assert os.listdir(os.path.join(cache, 'partial')) == []
+
+def test_checksum_mismatch_is_rejected(server, tmp_path):
+    cache = str(tmp_path / 'cache')
+    with pytest.raises(ModelFetchError, match='Checksum mismatch'):
+        fetch(server.url, str(tmp_path / 'models' / 'm.gguf'), cache_dir=cache, sha256='0' * 64)
+    assert os.listdir(os.path.join(cache, 'blobs')) == []
+    assert not os.path.exists(tmp_path / 'models' / 'm.gguf')
+
+def test_published_checksum_is_verified_and_keys_the_cache(server, tmp_path):
+    cache, dest = str(tmp_path / 'cache'), str(tmp_path / 'models' / 'm.gguf')
+    server.published = DIGEST
+    assert published_sha256(server.url) == DIGEST
+    blob = fetch(server.url, dest, cache_dir=cache)
+    assert os.path.basename(blob) == f"sha256-{DIGEST}"
+    assert read(dest) == DATA
+
+    # A cached blob for the published digest is reused without downloading
+    server.requests.clear()
+    fetch(server.url, dest, cache_dir=cache)
+    assert server.requests == []
+
+    server.published = 'f' * 64
+    with pytest.raises(ModelFetchError, match='Checksum mismatch'):
+        fetch(server.url, str(tmp_path / 'other.gguf'), cache_dir=str(tmp_path / 'cache2'))
@@ -0,0 +1,54 @@
+"""Checks for src/semantic_cache.py
+
+Usage:
+    python -m pytest tests/test_semantic_cache.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from semantic_cache import HashingEmbedder, SemanticCache, params_signature  # noqa: E402
+
+SIGNATURE = params_signature(max_tokens=150, temperature=0.7)
+
+def cache_with(prompt):
+    cache = SemanticCache(HashingEmbedder())
+    cache.insert(prompt, SIGNATURE, {'response': prompt, 'tokens_generated': 5})
+    return cache
+
+def test_opposite_meanings_are_not_hits():
+    # Same words, different answer: order and negation must count
+    pairs = [
+        ("convert celsius to fahrenheit", "convert fahrenheit to celsius"),
+        ("check if a number is prime", "check if a number is not prime"),
+        ("read a csv file with pandas", "read a csv file without pandas"),
+        ("write a function to sort a list", "use a function to sort a list"),
+        ("create a docker container", "delete a docker container")
+    ]
+    for cached, asked in pairs:
+        entry, similarity = cache_with(cached).lookup(asked, SIGNATURE)
+        assert entry is None, f"{asked!r} hit {cached!r} at {similarity:.3f}"
+
+def test_rephrasing_is_a_hit():
+    cache = cache_with("write a python function to sort a list")
+    entry, _ = cache.lookup("Write a Python function that sorts a list.", SIGNATURE)
+    assert entry is not None
+
+def test_matrix_grows_within_budget():
+    cache = SemanticCache(HashingEmbedder(), max_bytes=1024 * 1024)
+    cache.insert("first prompt", SIGNATURE, {'response': 'x'})
+    assert len(cache._vectors) == 16
+    for i in range(100):
+        cache.insert(f"prompt number {i} about topic {i * 7}", SIGNATURE, {'response': 'x' * 100})
+    assert cache.info()['entries'] == 101
+    assert len(cache._vectors) == 128
+    assert cache.info()['bytes'] <= cache.max_bytes
+
+def test_evicts_to_stay_in_budget():
+    cache = SemanticCache(HashingEmbedder(), max_bytes=64 * 1024)
+    for i in range(200):
+        cache.insert(f"prompt number {i} about topic {i * 7}", SIGNATURE, {'response': 'y' * 500})
+    info = cache.info()
+    assert info['evictions'] > 0
+    assert info['bytes'] <= cache.max_bytes
+    assert cache._vectors.nbytes <= cache.max_bytes
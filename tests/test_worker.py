@@ -0,0 +1,71 @@
+"""Checks for src/worker.py: restart, failover and cancellation with the mock backend
+
+Usage:
+    python -m pytest tests/test_worker.py
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from generation import GenerationCancelled, GenerationLimits  # noqa: E402
+from worker import WorkerBackend, WorkerUnavailable  # noqa: E402
+
+@pytest.fixture
+def backend(monkeypatch):
+    # Read by the child process at startup
+    monkeypatch.setenv('MOCK_LOAD_TIME', '0')
+    monkeypatch.setenv('MOCK_FAILURE_RATE', '0')
+    monkeypatch.setenv('MOCK_SPIKE_RATE', '0')
+    worker = WorkerBackend('mock', 'mock.gguf', start_timeout=30, request_timeout=30,
+                           heartbeat_timeout=15, max_retries=1)
+    yield worker
+    worker.close()
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+def running(worker):
+    """True once some request has been sent to the current child"""
+    with worker._lock:
+        return any(r.last_progress is not None for r in worker._pending.values())
+
+def test_crashed_worker_is_restarted_and_the_request_resubmitted(backend):
+    results = []
+    caller = threading.Thread(target=lambda: results.append(backend.generate('hello', max_tokens=10)))
+    caller.start()
+    wait_for(lambda: running(backend))
+    crashed = backend._proc.pid
+    backend._proc.kill()
+
+    caller.join(10)
+    assert results and results[0]['choices'][0]['text']
+    assert backend.stats['failovers'] == 1
+    assert backend.stats['restarts'] == 1
+    assert backend.worker_info()['pid'] not in (None, crashed)
+
+def test_partly_streamed_request_fails_instead_of_replaying(backend):
+    chunks = backend.stream('hello', max_tokens=100)
+    next(chunks)
+    backend._proc.kill()
+    with pytest.raises(WorkerUnavailable):
+        for _ in chunks:
+            pass
+    assert backend.stats['failovers'] == 0
+    assert backend.stats['failed_requests'] == 1
+
+def test_cancellation_reaches_the_child(backend):
+    limits = GenerationLimits()
+    threading.Timer(0.3, limits.cancel_event.set).start()
+    start = time.time()
+    # Uncancelled, 100 mock tokens take several seconds to decode
+    with pytest.raises(GenerationCancelled):
+        backend.generate('hello', max_tokens=100, limits=limits)
+    assert time.time() - start < 2
+    assert backend.stats['restarts'] == 0